@@ -0,0 +1,255 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import openpyxl
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import process_and_generate as pg
+
+# ==========================================
+# Benchmark: synthetic institution workbooks
+# ==========================================
+# Generates regulatory-style workbooks of configurable size, times each pipeline stage
+# on them and saves the results under benchmark_results/ for comparison across commits.
+# Runs offline; the only input read from the repo is the country/currency mapping file.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIRECTORY = REPO_ROOT / "benchmark_results"
+STAGES = ["read", "classify", "write", "searchIndex"]
+SCRIPT = Path(__file__).resolve().parent / "process_and_generate.py"
+STARTUP_COMMANDS = {
+    "import": [sys.executable, "-c", "import process_and_generate"],
+    "ingest": [sys.executable, str(SCRIPT), "ingest", "--startup-time"],  # every institution cached
+    "build-index": [sys.executable, str(SCRIPT), "build-index", "--startup-time"],
+    "stats": [sys.executable, str(SCRIPT), "stats", "--startup-time"],
+    "verify": [sys.executable, str(SCRIPT), "verify", "--startup-time"]
+}
+
+TRACK_COLUMN = "מספר מסלול"
+HEADERS = [
+    "מספר קופה/קרן/ח.פ. עבור חברת ביטוח", TRACK_COLUMN, "שם מסלול", "שם נייר ערך",
+    "ישראל/חו\"ל", "מדינה לפי חשיפה כלכלית", "ענף מסחר", "מטבע פעילות", "שווי הוגן (באלפי ש\"ח)"
+]
+HEBREW_WORDS = ["בנק", "לאומי", "הפועלים", "ממשל", "צמודה", "שקלי", "מערכות", "תעשיות", "השקעות",
+                "ביטוח", "אנרגיה", "נדל\"ן", "מניות", "פיננסים", "תקשורת", "כימיה", "מזון", "טכנולוגיה"]
+ENGLISH_WORDS = ["Global", "Equity", "Bond", "Index", "Fund", "Tech", "Holdings", "Corp", "Capital",
+                 "Energy", "Growth", "Value", "Income", "Select", "Dividend", "Small Cap", "Treasury"]
+SECTORS = ["בנקים", "ביטוח", "נדל\"ן ובינוי", "כימיה, גומי ופלסטיק", "ביטחוניות", "טכנולוגיה", "Technology", "Financials", ""]
+
+
+def load_countries():
+    with open(pg.MAPPING_FILE, 'r', encoding='utf-8') as f:
+        return [(entry["name"], entry.get("currency_code", "ILS"), entry.get("match_strings", [])) for entry in json.load(f)]
+
+
+def synthetic_name(rng, english_ratio, countries, distinct_names):
+    # Names repeat across tracks (as real holdings do); some carry a country in the name
+    k = rng.randrange(distinct_names)
+    words = ENGLISH_WORDS if rng.random() < english_ratio else HEBREW_WORDS
+    name = f"{words[k % len(words)]} {words[(k // len(words)) % len(words)]} {k}"
+    if k % 5 == 0:
+        _, _, match_strings = countries[k % len(countries)]
+        if match_strings: name = f"{name} {match_strings[k % len(match_strings)]}"
+    return name
+
+
+def write_workbook(path, args, seed):
+    # One sheet per FILE_MAPPING key (plus the excluded cover sheet), args.tracks tracks per
+    # sheet and args.rows rows per track. A few rows have no track id or a zero value, like the real reports.
+    rng = random.Random(seed)
+    countries = load_countries()
+    workbook = openpyxl.Workbook(write_only=True)
+    cover = workbook.create_sheet("עמוד פתיחה")
+    cover.append(["דוח רשימת נכסים ברמת נכס בודד (synthetic)"])
+    row_count = 0
+    for sheet_no, title in enumerate(list(pg.FILE_MAPPING)[:args.sheets]):
+        ws = workbook.create_sheet(title[:31])
+        for _ in range(args.preamble_rows): ws.append([f"synthetic report - {title}"])
+        ws.append(HEADERS)
+        for track_no in range(args.tracks):
+            track_id = 10000 + track_no
+            for _ in range(args.rows):
+                country_name, currency, _ = countries[rng.randrange(len(countries))]
+                has_country = rng.random() < args.country_ratio
+                value = 0 if rng.random() < 0.03 else round(rng.uniform(-50, 5000), 3)
+                ws.append([
+                    9999,
+                    "" if rng.random() < 0.01 else track_id,
+                    f"מסלול סינתטי {track_no}",
+                    synthetic_name(rng, args.english_ratio, countries, args.distinct_names),
+                    ("ישראל" if country_name == "Israel" else "חו\"ל") if has_country or rng.random() < 0.5 else "",
+                    country_name if has_country else "",
+                    SECTORS[rng.randrange(len(SECTORS))],
+                    currency if has_country else "",
+                    value
+                ])
+                row_count += 1
+    workbook.save(path)
+    return row_count
+
+
+def run_once(workbooks, output_dir, streaming=False):
+    timings = {stage: 0.0 for stage in STAGES}
+    # Every run classifies from cold; the in-memory caches would otherwise carry over between repeats
+    pg.CLASSIFICATION_CACHE.clear()
+    pg.NEW_CLASSIFICATIONS.clear()
+    pg.COUNTRY_NAME_CACHE.clear()
+    search_index = pg.new_search_index()
+    for excel_path in workbooks:
+        inst_key = excel_path.stem
+        config = {"institutions": {}}
+        fragment = pg.new_search_index()
+        target_dir = output_dir / inst_key
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        start = time.perf_counter()
+        sheets = list(pg.read_excel_sheets(excel_path, chunk_rows=pg.STREAMING_CHUNK_ROWS if streaming else None))
+        timings["read"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        all_data = pg.process_institution_data(sheets, inst_key, config, {}, streaming=streaming)
+        timings["classify"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        pg.generate_jsons(target_dir, all_data, inst_key, config, fragment)
+        timings["write"] += time.perf_counter() - start
+        pg.merge_search_index(search_index, fragment)
+
+    start = time.perf_counter()
+    pg.write_json(output_dir / "search_index.json", search_index)
+    pg.write_search_shards(search_index, output_dir / "search")
+    timings["searchIndex"] += time.perf_counter() - start
+    return timings
+
+
+def measure_startup(workbooks, base, repeat):
+    # Wall time of each CLI command in a fresh interpreter, against a project directory built from the workbooks
+    (base / "institution_reports").mkdir(parents=True)
+    for path in workbooks: shutil.copy(path, base / "institution_reports" / path.name)
+    shutil.copy(REPO_ROOT / "master_country_currency_map.json", base)
+    env = {**os.environ, "PENSION_TRACKER_BASE": str(base), "PYTHONPATH": str(SCRIPT.parent)}
+    subprocess.run([sys.executable, str(SCRIPT), "ingest"], env=env, cwd=base, capture_output=True, check=True)
+    startup = {}
+    for command, cmd in STARTUP_COMMANDS.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            proc = subprocess.run(cmd, env=env, cwd=base, capture_output=True, text=True, check=True)
+            times.append(time.perf_counter() - start)
+        report = [line for line in proc.stderr.splitlines() if line.startswith("Startup:")]
+        startup[command] = {"best": round(min(times), 6), "median": round(statistics.median(times), 6),
+                            "heavyModules": report[0].split("heavy modules loaded: ")[1] if report else None}
+        pg.log(f"  {command:<12} {startup[command]['best'] * 1000:>7.0f}ms  (heavy modules: {startup[command]['heavyModules'] or 'n/a'})")
+    return startup
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception: return "unknown"
+
+
+def compare(result, baseline_path):
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline["params"] != result["params"]:
+        pg.log("[!] Benchmark parameters differ from the baseline; timings are not comparable.")
+    pg.log(f"Compared with {baseline['label']} (best of runs, seconds):")
+    for stage in STAGES + ["total"]:
+        old, new = baseline["stages"][stage]["best"], result["stages"][stage]["best"]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        pg.log(f"  {stage:<12} {old:>9.3f} -> {new:>9.3f}  ({change})")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic institution workbooks.")
+    parser.add_argument("--institutions", type=int, default=2, help="Number of synthetic workbooks (default: 2).")
+    parser.add_argument("--sheets", type=int, default=len(pg.FILE_MAPPING),
+                        help=f"Sheets per workbook, one per FILE_MAPPING key (default: all {len(pg.FILE_MAPPING)}).")
+    parser.add_argument("--tracks", type=int, default=10, help="Tracks per sheet (default: 10).")
+    parser.add_argument("--rows", type=int, default=100, help="Rows per track in each sheet (default: 100).")
+    parser.add_argument("--english-ratio", type=float, default=0.3, help="Share of English asset names (default: 0.3).")
+    parser.add_argument("--country-ratio", type=float, default=0.7,
+                        help="Share of rows with the country column filled; the rest fall back to name matching (default: 0.7).")
+    parser.add_argument("--distinct-names", type=int, default=2000, help="Size of the asset name pool (default: 2000).")
+    parser.add_argument("--preamble-rows", type=int, default=0, help="Title rows above each sheet's header (default: 0).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs; the best and median are reported (default: 3).")
+    parser.add_argument("--streaming", action="store_true", help="Benchmark the --streaming ingest.")
+    parser.add_argument("--startup", action="store_true",
+                        help="Also time each process_and_generate command (ingest with a warm cache, build-index, stats, verify) in fresh processes.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", help="Result name (default: git describe of the working tree).")
+    parser.add_argument("--compare", metavar="RESULT_JSON", help="Print stage deltas against an earlier result file.")
+    parser.add_argument("--keep-workbooks", metavar="DIR", help="Write the synthetic workbooks to DIR and keep them.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pg.MAPPING_FILE = REPO_ROOT / "master_country_currency_map.json"
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not pg.load_mappings(): sys.exit(f"Could not load {pg.MAPPING_FILE}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workbook_dir = Path(args.keep_workbooks) if args.keep_workbooks else Path(tmp) / "workbooks"
+        workbook_dir.mkdir(parents=True, exist_ok=True)
+        pg.log(f"Generating {args.institutions} synthetic workbooks in {workbook_dir}...")
+        workbooks, rows = [], 0
+        for n in range(args.institutions):
+            path = workbook_dir / f"Synthetic_{n}.xlsx"
+            rows += write_workbook(path, args, args.seed + n)
+            workbooks.append(path)
+        pg.log(f"{rows:,} rows generated.")
+
+        runs = []
+        for n in range(args.repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                timings = run_once(workbooks, Path(tmp) / f"out_{n}", args.streaming)
+            timings["total"] = sum(timings.values())
+            runs.append(timings)
+            pg.log(f"Run {n + 1}/{args.repeat}: " + ", ".join(f"{k} {v:.3f}s" for k, v in timings.items()))
+
+        startup = None
+        if args.startup:
+            pg.log("Command startup (best of runs):")
+            startup = measure_startup(workbooks, Path(tmp) / "project", args.repeat)
+
+    label = args.label or git_revision()
+    params = {k: v for k, v in vars(args).items() if k not in ["label", "compare", "keep_workbooks", "repeat", "startup"]}
+    result = {
+        "label": label,
+        "revision": git_revision(),
+        "generatedAt": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "params": params,
+        "rows": rows,
+        "peakMemoryMB": pg.peak_memory_mb(),
+        "stages": {stage: {"best": round(min(r[stage] for r in runs), 6),
+                           "median": round(statistics.median(r[stage] for r in runs), 6),
+                           "runs": [round(r[stage], 6) for r in runs]}
+                   for stage in STAGES + ["total"]}
+    }
+    if startup: result["startup"] = startup
+    RESULTS_DIRECTORY.mkdir(exist_ok=True)
+    result_file = RESULTS_DIRECTORY / f"{label}.json"
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    pg.log(f"Results saved to {result_file}")
+    if args.compare: compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
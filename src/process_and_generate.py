@@ -1,28 +1,85 @@
-import pandas as pd
+import time
+MODULE_IMPORT_START = time.perf_counter()
+import importlib.util
 import json
+import hashlib
+import sqlite3
+import inspect
+import gzip
+import shutil
+import argparse
 import glob
 import os
 import math
+import itertools
+import mmap
+import struct
+import bisect
+from array import array
 import sys
+import types
+import threading
+import tracemalloc
+import cProfile
+from contextlib import closing, contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import re
 import warnings
 from pathlib import Path
 from datetime import datetime
 
+def lazy_import(name):
+    # The module is executed on first attribute access, so commands that never use it skip the import
+    if name in sys.modules: return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None: raise ImportError(f"No module named {name!r}")
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# Heavy dependencies: only ingest needs pandas and openpyxl, and build-index numpy; stats and verify need none
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
+openpyxl = lazy_import("openpyxl")
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "pyarrow"]
+
+try:
+    import brotli  # Optional: .json.br siblings in --production mode
+except ImportError:
+    brotli = None
+# Optional: the holdings table is written as Parquet when available (imported where it is used)
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+try:
+    import resource  # Peak memory in build_report.json (not available on Windows)
+except ImportError:
+    resource = None
+
 # Suppress Excel validation warnings
 warnings.filterwarnings('ignore', category=UserWarning, module='openpyxl')
 
 # ==========================================
 # 1. CONFIGURATION
 # ==========================================
-BASE_PATH = Path("/Users/matanya/git-repos/Israel-Pension-Tracker")
+# Project directory: --base, else $PENSION_TRACKER_BASE, else the repository this script is in.
+# The paths below derive from it (see configure_paths).
+BASE_PATH = Path(os.environ.get("PENSION_TRACKER_BASE") or Path(__file__).resolve().parent.parent)
 INPUT_DIRECTORY = BASE_PATH / "institution_reports"
 OUTPUT_BASE_DIRECTORY = BASE_PATH / "data"
 CONFIG_FILE = BASE_PATH / "config.json"
 MASTER_TRACK_FILE = BASE_PATH / "master_track_list.json"
 MAPPING_FILE = BASE_PATH / "master_country_currency_map.json"
+BUILD_CACHE_DIRECTORY = OUTPUT_BASE_DIRECTORY / ".build_cache"
+CLASSIFICATION_CACHE_FILE = BUILD_CACHE_DIRECTORY / "classification.sqlite"
+BUILD_REPORT_FILE = BASE_PATH / "build_report.json"
+PROFILE_DIRECTORY = BASE_PATH / "profiles"
+HISTORY_DIRECTORY = BASE_PATH / "history"
+HOLDINGS_TABLE_DIRECTORY = BASE_PATH / "holdings_table"
 
 ITEMS_PER_PAGE = 10
+STREAMING_CHUNK_ROWS = 10_000  # --streaming: sheet rows parsed and classified per batch
 
 # Columns to search for Track Name
 TRACK_NAME_COLUMNS = ["שם מסלול", "שם המסלול", "שם קופה", "שם הקופה", "שם מסלול השקעה"]
@@ -46,6 +103,14 @@ CURRENCY_COLUMNS = ["מטבע פעילות", "מטבע", "סוג מטבע", "ב
 # Sector Columns
 SECTOR_COLUMNS = ["ענף מסחר", "ענף", "סקטור", "Sector", "Industry", "Trade Sector"]
 
+# General Israel/Abroad Columns (country fallback)
+GENERAL_LOCATION_COLUMNS = ["ישראל/חו\"ל", "ישראל/חו''ל", "Israel/Abroad"]
+
+# Security Identifier Columns (entity resolution) and the id type column beside them
+SECURITY_ID_COLUMNS = ["מספר נייר ערך", "ISIN"]
+SECURITY_ID_TYPE_COLUMNS = ["סוג מספר נייר ערך"]
+INTERNAL_SECURITY_ID_TYPES = ["פנימי"]  # Numbered by the institution itself, so they can't join institutions
+
 FILE_MAPPING = {
     "מזומנים": ("Cash & Equivalents", "Cash"),
     "פיקדונות": ("Cash & Equivalents", "Deposits"),
@@ -75,18 +140,92 @@ FILE_MAPPING = {
 COUNTRY_LOOKUP = {}      
 EMOJI_TO_NAME = {}       
 CURRENCY_LOOKUP = {}     
+COUNTRY_MATCHER = None   # Aho-Corasick automaton over COUNTRY_LOOKUP keys (built in load_mappings)
+COUNTRY_NAME_CACHE = {}  # lowercased asset name -> emoji (or None when nothing matches)
 HEDGED_KEYWORDS = ["מנוטרל", "גידור", "hedged", "currency hedged", "נטרול"]
+CLASSIFICATION_CACHE = {}  # classify_holding key -> (emoji, currency, sector), persisted in CLASSIFICATION_CACHE_FILE
+NEW_CLASSIFICATIONS = {}   # entries not yet written to CLASSIFICATION_CACHE_FILE
 
 # --- Search Index ---
-GLOBAL_SEARCH_INDEX = {
-    "holdings": {},   # normalized -> {displayName, countryEmoji, occurrences: []}
-    "tracks": [],     # List of track objects
-    "countries": {},  # normalized -> {displayName, occurrences: []}
-    "currencies": {}, # normalized -> {displayName, occurrences: []}
-    "sectors": {}     # normalized -> {displayName, occurrences: []}
-}
+def new_search_index():
+    return {
+        "holdings": {},   # normalized -> {displayName, countryEmoji, occurrences: []}
+        "tracks": [],     # List of track objects
+        "countries": {},  # normalized -> {displayName, occurrences: []}
+        "currencies": {}, # normalized -> {displayName, occurrences: []}
+        "sectors": {}     # normalized -> {displayName, occurrences: []}
+    }
+
+GLOBAL_SEARCH_INDEX = new_search_index()
 MIN_HOLDING_PERCENTAGE = 0.5
 
+# --- Sharded Search Index (data/search/) ---
+# Holdings are bucketed by the first letters of each word of their normalized name,
+# so the dashboard only downloads the bucket a query needs.
+SEARCH_SHARD_PREFIX_LENGTH = 2
+SEARCH_WORD_SEPARATORS = r"[\s\-/(),.]+"  # Must match SEARCH_WORD_SEPARATORS in index.html
+HEBREW_PREFIX_LETTERS = "ובהלמשכ"          # Attached prefixes ("הבנק" is also filed under "בנ")
+
+# --- Binary Search Index (data/search_index.bin) ---
+# The holdings section of the search index in a memory-mappable layout, for Python tools:
+#   header | key table (sorted by UTF-8 key) | occurrence records | string blob | metadata JSON
+# Key entries and occurrences are fixed-size records, so a lookup is a binary search over the mmap.
+BINARY_SEARCH_INDEX_FILE = "search_index.bin"
+BINARY_INDEX_MAGIC = b"IPTSIDX1"
+BINARY_INDEX_HEADER = struct.Struct("<8sIIQQQQQ")  # magic, keys, occurrences, offsets of the five sections
+BINARY_INDEX_KEY = struct.Struct("<IIIIIIII")       # key, display name, emoji (offset, length into the blob); first occurrence, count
+BINARY_INDEX_OCCURRENCE = struct.Struct("<IHHd")    # track ref, class id, subclass id, value
+
+# --- Production Output (--production) ---
+# Minified JSON, columnar holdings and precompressed .gz/.br siblings for static hosting
+JSON_MINIFIED_SEPARATORS = (',', ':')
+COMPRESSED_SIBLINGS = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0)),
+                       (".br", (lambda data: brotli.compress(data, quality=11)) if brotli else None)]
+
+# --- Output Writer ---
+# generate_jsons hands finished track files to a thread pool and carries on aggregating
+OUTPUT_WRITER_THREADS = 4
+OUTPUT_WRITER_MAX_PENDING = 32  # writes queued or running before the producer waits
+OUTPUT_TOTALS_LOCK = threading.Lock()
+
+# --- Holdings Matrix (data/<institution>/holdings_matrix.json) ---
+# Sparse track-by-label matrices, one per dimension, for the Compare view and the
+# similarity index: one row per track, each entry a label's share of the track's total assets (percent)
+HOLDINGS_MATRIX_FILE = "holdings_matrix.json"
+HOLDINGS_MATRIX_DECIMALS = 4
+HOLDINGS_MATRIX_DIMENSIONS = ["holdings", "assetClasses", "countries", "currencies", "sectors"]
+
+# --- Similar Tracks (data/similar_tracks.json) ---
+# Each track's nearest tracks across all institutions, by a weighted mean of per-dimension cosine similarity
+SIMILAR_TRACKS_FILE = "similar_tracks.json"
+SIMILAR_TRACKS_K = 5
+SIMILARITY_WEIGHTS = {"holdings": 0.4, "assetClasses": 0.15, "countries": 0.15, "currencies": 0.15, "sectors": 0.15}
+
+# --- Exposure Rankings (data/<institution>/exposures.json, data/rankings.json) ---
+# Each track's share per asset class, country, currency, sector and country / asset class pair
+EXPOSURES_FILE = "exposures.json"
+RANKINGS_FILE = "rankings.json"
+EXPOSURE_DIMENSIONS = ["assetClasses", "countries", "currencies", "sectors", "countryAssetClasses"]
+RANKINGS_TOP_N = 10
+RANKING_PERCENTILES = [10, 25, 50, 75, 90]
+
+# --- Entity Resolution (data/entities.json) ---
+# Holding names from every institution grouped into canonical entities; see build_entity_index
+ENTITIES_FILE = "entities.json"
+ENTITY_NAME_SUFFIXES = {"בעמ", "ltd", "inc", "plc", "corp", "co", "llc", "lp", "sa", "ag", "nv"}
+ENTITY_BLOCK_PREFIX_LENGTH = 3
+ENTITY_BLOCK_LIMIT = 300          # Blocks with more names than this (very common prefixes) are not compared pairwise
+ENTITY_SPELLING_MIN_WORD = 6      # Shorter words must match exactly; longer ones may differ by one edit
+ENTITY_SPELLING_MIN_KEY = 20       # Shorter (ticker-like) keys only tolerate spacing differences
+
+# --- History (history/<institution>/<period>.json, data/<institution>/history/<track id>.json) ---
+# Append-only store: each report period keeps per-track summaries in full and holdings as a
+# delta against the previous period. Per-track time series for the dashboard are rebuilt from it.
+PERIOD_PATTERN = r"\d{4}-Q[1-4]"
+REPORT_QUARTER_LABEL = "רבעון הדיווח"
+REPORT_YEAR_LABEL = "שנת הדיווח"
+HISTORY_SUMMARY_DIMENSIONS = ["assetClasses", "currencies", "countries"]
+
 # ==========================================
 # 2. HELPER FUNCTIONS
 # ==========================================
@@ -94,6 +233,56 @@ MIN_HOLDING_PERCENTAGE = 0.5
 def log(msg):
     print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
 
+PATH_SETTINGS = ["BASE_PATH", "INPUT_DIRECTORY", "OUTPUT_BASE_DIRECTORY", "CONFIG_FILE", "MASTER_TRACK_FILE", "MAPPING_FILE", "BUILD_CACHE_DIRECTORY",
+                 "CLASSIFICATION_CACHE_FILE", "BUILD_REPORT_FILE", "PROFILE_DIRECTORY", "HISTORY_DIRECTORY", "HOLDINGS_TABLE_DIRECTORY"]
+
+def configure_paths(base=None, input_dir=None, output_dir=None):
+    # Re-derives every path setting from --base, --input and --output
+    global BASE_PATH, INPUT_DIRECTORY, OUTPUT_BASE_DIRECTORY, CONFIG_FILE, MASTER_TRACK_FILE, MAPPING_FILE, BUILD_CACHE_DIRECTORY, \
+        CLASSIFICATION_CACHE_FILE, BUILD_REPORT_FILE, PROFILE_DIRECTORY, HISTORY_DIRECTORY, HOLDINGS_TABLE_DIRECTORY
+    if base: BASE_PATH = Path(base)
+    INPUT_DIRECTORY = Path(input_dir) if input_dir else BASE_PATH / "institution_reports"
+    OUTPUT_BASE_DIRECTORY = Path(output_dir) if output_dir else BASE_PATH / "data"
+    CONFIG_FILE = BASE_PATH / "config.json"
+    MASTER_TRACK_FILE = BASE_PATH / "master_track_list.json"
+    MAPPING_FILE = BASE_PATH / "master_country_currency_map.json"
+    BUILD_CACHE_DIRECTORY = OUTPUT_BASE_DIRECTORY / ".build_cache"
+    CLASSIFICATION_CACHE_FILE = BUILD_CACHE_DIRECTORY / "classification.sqlite"
+    BUILD_REPORT_FILE = BASE_PATH / "build_report.json"
+    PROFILE_DIRECTORY = BASE_PATH / "profiles"
+    HISTORY_DIRECTORY = BASE_PATH / "history"
+    HOLDINGS_TABLE_DIRECTORY = BASE_PATH / "holdings_table"
+
+def loaded_heavy_modules():
+    # HEAVY_MODULES this process has actually executed (a lazy_import placeholder doesn't count)
+    return [name for name in HEAVY_MODULES if type(sys.modules.get(name)) is types.ModuleType]
+
+@contextmanager
+def stage(timings, name, profilers=None):
+    # Adds the block's wall time to timings[name]; with profilers (--profile) it also
+    # runs under that stage's cProfile.Profile, created on first use
+    profiler = profilers.setdefault(name, cProfile.Profile()) if profilers is not None else None
+    start = time.perf_counter()
+    if profiler: profiler.enable()
+    try: yield
+    finally:
+        if profiler: profiler.disable()
+        timings[name] = round(timings.get(name, 0.0) + time.perf_counter() - start, 6)
+
+def peak_memory_mb(children=False):
+    # Peak resident set size of this process so far (never reset, so it is a run-level figure);
+    # with children, that of the largest finished worker process
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+def traced_peak_mb():
+    # Peak of the memory traced by tracemalloc since the last call, or None when not tracing (--trace-memory)
+    if not tracemalloc.is_tracing(): return None
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    return round(peak / (1 << 20), 1)
+
 def normalize_search_text(text):
     if not text: return ""
     # Lowercase and remove Hebrew diacritics + specific chars
@@ -102,8 +291,68 @@ def normalize_search_text(text):
     text = re.sub(r'[\'"״׳]', '', text)         # Quotes
     return text.strip()
 
+def build_country_matcher(lookup):
+    # Aho-Corasick automaton over the lookup keys. Priority is the key's position
+    # in the lookup, so matching keeps the original first-key-wins order.
+    goto, fail, out = [{}], [0], [[]]
+    keys, emojis = [], []
+    for priority, (match_str, emoji) in enumerate(lookup.items()):
+        keys.append(match_str)
+        emojis.append(emoji)
+        if len(match_str) < 2: continue # Never matched by name
+        state = 0
+        for ch in match_str:
+            if ch not in goto[state]:
+                goto.append({}); fail.append(0); out.append([])
+                goto[state][ch] = len(goto) - 1
+            state = goto[state][ch]
+        out[state].append((priority, len(match_str)))
+
+    queue = list(goto[0].values())
+    for state in queue:
+        for ch, nxt in goto[state].items():
+            f = fail[state]
+            while f and ch not in goto[f]: f = fail[f]
+            fail[nxt] = goto[f].get(ch, 0)
+            out[nxt] = out[nxt] + out[fail[nxt]]
+            queue.append(nxt)
+    return {"goto": goto, "fail": fail, "out": out, "keys": keys, "emojis": emojis}
+
+def is_word_boundary(text, idx):
+    # Mirrors the regex class (?:^|$|[\s\(\)\[\],.-]) used for two-letter keys
+    return idx < 0 or idx >= len(text) or text[idx].isspace() or text[idx] in "()[],.-"
+
+def match_country_name(name_lower):
+    if name_lower in COUNTRY_NAME_CACHE: return COUNTRY_NAME_CACHE[name_lower]
+    goto, fail, out = COUNTRY_MATCHER["goto"], COUNTRY_MATCHER["fail"], COUNTRY_MATCHER["out"]
+    matched = set()
+    state = 0
+    for i, ch in enumerate(name_lower):
+        while state and ch not in goto[state]: state = fail[state]
+        state = goto[state].get(ch, 0)
+        for priority, length in out[state]:
+            if priority in matched: continue
+            # RULE 1: Length Safety
+            # - If len >= 3: Allow partial match (e.g. "USA" inside string)
+            # - If len == 2: Require word boundaries (e.g. " US " is ok, "TRUST" is not)
+            if length == 2 and not (is_word_boundary(name_lower, i - 2) and is_word_boundary(name_lower, i + 1)): continue
+            matched.add(priority)
+
+    result = None
+    for priority in sorted(matched):
+        match_str = COUNTRY_MATCHER["keys"][priority]
+        # RULE 2: Exclusion Logic (The "ex-" fix)
+        # Ensure we don't trigger on "ex china"
+        exclusion_patterns = [f"ex {match_str}", f"ex-{match_str}", f"ex.{match_str}"]
+        if any(ex in name_lower for ex in exclusion_patterns):
+            continue # This country is explicitly excluded, keep searching
+        result = COUNTRY_MATCHER["emojis"][priority]
+        break
+    COUNTRY_NAME_CACHE[name_lower] = result
+    return result
+
 def load_mappings():
-    global COUNTRY_LOOKUP, EMOJI_TO_NAME, CURRENCY_LOOKUP
+    global COUNTRY_LOOKUP, EMOJI_TO_NAME, CURRENCY_LOOKUP, COUNTRY_MATCHER
     if not MAPPING_FILE.exists():
         log(f"[!!!] CRITICAL: Mapping file not found at {MAPPING_FILE}")
         return False
@@ -126,6 +375,10 @@ def load_mappings():
                 if len(clean_s) > 2:
                     CURRENCY_LOOKUP[clean_s.lower()] = curr_code
             count += 1
+        COUNTRY_MATCHER = build_country_matcher(COUNTRY_LOOKUP)
+        COUNTRY_NAME_CACHE.clear()
+        CLASSIFICATION_CACHE.clear()
+        NEW_CLASSIFICATIONS.clear()
         log(f"Mappings loaded successfully for {count} entries.")
         return True
     except Exception as e:
@@ -165,57 +418,31 @@ def get_category(filename):
             return cls, sub
     return "Other Assets", "Unclassified"
 
-def get_column_value(row, possible_columns):
-    keys = [k.strip() for k in row.keys()]
-    for col in possible_columns:
-        if col in keys:
-            val = row[col]
-            if pd.notna(val) and str(val).strip() not in ['nan', 'ריק במקור']:
-                return str(val).strip()
+def get_column_value(values, positions):
+    # First usable value among a row's candidate columns (positions from resolve_sheet_schema), else None
+    for pos in positions:
+        val = values[pos]
+        if pd.notna(val) and str(val).strip() not in ['nan', 'ריק במקור']:
+            return str(val).strip()
     return None
 
-def get_country_emoji(row, asset_class=""):
+def resolve_country_emoji(country_val, asset_name, general_val, asset_class=""):
     # 1. Check specific country columns (Exact Match)
-    val = get_column_value(row, COUNTRY_COLUMNS)
-    if val:
-        clean_raw = str(val).strip()
+    if country_val:
+        clean_raw = str(country_val).strip()
         if clean_raw in COUNTRY_LOOKUP: return COUNTRY_LOOKUP[clean_raw]
         clean_no_quotes = clean_raw.replace('"', '').replace("'", "")
         if clean_no_quotes in COUNTRY_LOOKUP: return COUNTRY_LOOKUP[clean_no_quotes]
         if clean_raw.lower() in COUNTRY_LOOKUP: return COUNTRY_LOOKUP[clean_raw.lower()]
 
     # 2. Check Asset Name
-    asset_name = get_column_value(row, NAME_COLUMNS)
     if asset_name:
-        name_clean = str(asset_name).strip()
-        name_lower = name_clean.lower()
-        
-        for match_str, emoji in COUNTRY_LOOKUP.items():
-            # RULE 1: Length Safety
-            # - If len >= 3: Allow partial match (e.g. "USA" inside string)
-            # - If len == 2: Require word boundaries (e.g. " US " is ok, "TRUST" is not)
-            is_match = False
-            
-            if len(match_str) >= 3:
-                if match_str in name_lower: is_match = True
-            elif len(match_str) == 2:
-                # Regex check for " US ", "US)", "(US", "US," etc.
-                pattern = r'(?:^|[\s\(\)\[\],.-])' + re.escape(match_str) + r'(?:$|[\s\(\)\[\],.-])'
-                if re.search(pattern, name_lower): is_match = True
-
-            if is_match:
-                # RULE 2: Exclusion Logic (The "ex-" fix)
-                # Ensure we don't trigger on "ex china"
-                exclusion_patterns = [f"ex {match_str}", f"ex-{match_str}", f"ex.{match_str}"]
-                if any(ex in name_lower for ex in exclusion_patterns):
-                    continue # This country is explicitly excluded, keep searching
-                
-                return emoji
+        emoji = match_country_name(str(asset_name).strip().lower())
+        if emoji is not None: return emoji
 
     # 3. Fallback: General Israel/Abroad column
-    val_general = get_column_value(row, ["ישראל/חו\"ל", "ישראל/חו''ל", "Israel/Abroad"])
-    if val_general:
-        if "ישראל" in str(val_general) or "Israel" in str(val_general):
+    if general_val:
+        if "ישראל" in str(general_val) or "Israel" in str(general_val):
              return "🇮🇱"
 
     # 4. Smart Default for Cash/Loans
@@ -224,13 +451,12 @@ def get_country_emoji(row, asset_class=""):
     # 5. Generic Fallback
     return "🌎"
 
-def detect_currency(row, country_emoji, asset_name):
+def resolve_currency(currency_val, country_emoji, asset_name):
     name_str = str(asset_name).lower() if asset_name else ""
     if any(k in name_str for k in HEDGED_KEYWORDS): return "ILS"
 
-    val = get_column_value(row, CURRENCY_COLUMNS)
-    if val:
-        clean = str(val).strip().lower()
+    if currency_val:
+        clean = str(currency_val).strip().lower()
         for match_str, code in CURRENCY_LOOKUP.items():
             if match_str in clean: return code
         if "צמוד מדד" in clean: return "ILS" 
@@ -245,16 +471,74 @@ def detect_currency(row, country_emoji, asset_name):
     if country_emoji in ["🇪🇺", "🇫🇷", "🇩🇪", "🇳🇱", "🇮🇹", "🇪🇸"]: return "EUR"
     return "ILS"
 
-def get_sector(row, asset_class=""):
-    val = get_column_value(row, SECTOR_COLUMNS)
-    if val:
-        clean = str(val).strip()
+def resolve_sector(sector_val, asset_class=""):
+    if sector_val:
+        clean = str(sector_val).strip()
         if len(clean) > 1 and clean.lower() != 'nan':
             return clean
     if asset_class == "Bonds": return "Government / General"
     if asset_class == "Cash & Equivalents": return "Liquidity"
     return "General"
 
+# --- Classification Cache ---
+# The same holdings (government bonds, big ETFs, cash lines) recur in every report, so
+# resolved (emoji, currency, sector) triples are kept across runs in a SQLite file. The
+# cache is emptied whenever the mapping file, HEDGED_KEYWORDS or the rules below change.
+
+def classify_holding(country_val, asset_name, general_val, currency_val, sector_val, asset_class):
+    # Every rule only sees the asset name lowercased, so that is the form in the key
+    key = (country_val, asset_name.lower() if asset_name else "", general_val, currency_val, sector_val, asset_class)
+    result = CLASSIFICATION_CACHE.get(key)
+    if result is None:
+        emoji = resolve_country_emoji(country_val, asset_name, general_val, asset_class)
+        result = (emoji, resolve_currency(currency_val, emoji, asset_name or "Unknown Asset"), resolve_sector(sector_val, asset_class))
+        CLASSIFICATION_CACHE[key] = NEW_CLASSIFICATIONS[key] = result
+    return result
+
+def classification_fingerprint():
+    digest = hashlib.sha256()
+    digest.update(file_hash(MAPPING_FILE).encode())
+    digest.update(json.dumps(HEDGED_KEYWORDS, ensure_ascii=False).encode())
+    for func in [build_country_matcher, is_word_boundary, match_country_name, resolve_country_emoji,
+                 resolve_currency, resolve_sector, classify_holding]:
+        digest.update(inspect.getsource(func).encode())
+    return digest.hexdigest()
+
+def open_classification_cache():
+    CLASSIFICATION_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(CLASSIFICATION_CACHE_FILE, timeout=60)
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS classifications (key TEXT PRIMARY KEY, emoji TEXT, currency TEXT, sector TEXT)")
+    return db
+
+def load_classification_cache():
+    # Call after load_mappings
+    fingerprint = classification_fingerprint()
+    try:
+        with closing(open_classification_cache()) as db, db:
+            stored = db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+            if stored is None or stored[0] != fingerprint:
+                db.execute("DELETE FROM classifications")
+                db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+                log("Classification cache reset (mappings or classification rules changed).")
+                return
+            for key, emoji, currency, sector in db.execute("SELECT key, emoji, currency, sector FROM classifications"):
+                CLASSIFICATION_CACHE[tuple(json.loads(key))] = (emoji, currency, sector)
+        log(f"Loaded {len(CLASSIFICATION_CACHE):,} cached classifications.")
+    except sqlite3.Error as e:
+        log(f"[!] Classification cache unavailable: {e}")
+
+def save_classification_cache():
+    # Safe to call from several worker processes; SQLite serialises the writes
+    if not NEW_CLASSIFICATIONS: return
+    try:
+        with closing(open_classification_cache()) as db, db:
+            db.executemany("INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?)",
+                           [(json.dumps(key, ensure_ascii=False), *result) for key, result in NEW_CLASSIFICATIONS.items()])
+        NEW_CLASSIFICATIONS.clear()
+    except sqlite3.Error as e:
+        log(f"[!] Could not save the classification cache: {e}")
+
 def clean_value(val):
     s = str(val).strip()
     if pd.isna(val) or s in ['nan', 'ריק במקור', 'תא ללא תוכן, המשך בתא הבא']: return 0.0
@@ -272,218 +556,811 @@ def get_safe_filename(name):
     clean = clean.replace(" ", "_")
     return f"{clean}.json"
 
-def detect_header_row(xls, sheet_name):
+def encode_json(obj, indent=None, production=False):
+    if production: return json.dumps(obj, ensure_ascii=False, separators=JSON_MINIFIED_SEPARATORS).encode('utf-8')
+    return json.dumps(obj, indent=indent, ensure_ascii=False).encode('utf-8')
+
+def file_matches(path, data):
+    try: return path.stat().st_size == len(data) and file_hash(path) == hashlib.sha256(data).hexdigest()
+    except FileNotFoundError: return False
+
+def write_file_atomic(path, data):
+    # Writes through a temp file and a rename, so readers never see a half-written file.
+    # A file whose content hash already matches is left untouched. Returns whether it was written.
+    if file_matches(path, data): return False
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
     try:
-        df_preview = pd.read_excel(xls, sheet_name=sheet_name, header=None, nrows=20)
-        for idx, row in df_preview.iterrows():
-            row_str = " ".join([str(x) for x in row.values])
-            if "מספר מסלול" in row_str: return idx
-        return 0
-    except: return 0
+        with open(tmp, 'wb') as f: f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return True
 
-def split_excel_to_csvs(file_path, target_dir):
+def write_json(path, obj, indent=None, production=False, totals=None, before=None):
+    # In production mode the JSON is minified and compressed siblings are written next to it;
+    # otherwise stale siblings from an earlier production run are removed.
+    # totals (optional) accumulates byte counts; "before" is the default-mode size, measured
+    # on `before` when obj has been rearranged into the production layout. Safe to call from
+    # output_writer threads.
+    data = encode_json(obj, indent, production)
+    # Siblings are written before the JSON: after a crash between the two the JSON is still the old
+    # one, so the next run sees it as changed and rewrites the siblings too
+    unchanged = file_matches(path, data)
+    sizes = {"json": len(data)}
+    for ext, compress in COMPRESSED_SIBLINGS:
+        sibling = path.with_name(path.name + ext)
+        if not production or compress is None:
+            sibling.unlink(missing_ok=True)
+            continue
+        # Compression is deterministic, so an unchanged file's existing sibling is still current
+        if unchanged and sibling.exists():
+            sizes[ext[1:]] = sibling.stat().st_size
+            continue
+        packed = compress(data)
+        write_file_atomic(sibling, packed)
+        sizes[ext[1:]] = len(packed)
+    if not unchanged: write_file_atomic(path, data)
+    if totals is not None:
+        sizes["before"] = len(encode_json(obj if before is None else before, indent)) if production else len(data)
+        with OUTPUT_TOTALS_LOCK:
+            for key, n in sizes.items(): totals[key] = totals.get(key, 0) + n
+    return sizes
+
+def remove_stale_outputs(directory, written, pattern="*.json*"):
+    # Deletes the JSON files matching pattern that this run did not write, with their compressed
+    # siblings. Output directories are rewritten in place, so unchanged files keep their mtime.
+    for path in directory.glob(pattern):
+        name = path.name
+        for ext, _ in COMPRESSED_SIBLINGS:
+            if name.endswith(ext): name = name[:-len(ext)]
+        if name.endswith(".json") and name not in written: path.unlink()
+
+@contextmanager
+def output_writer(threads=OUTPUT_WRITER_THREADS, max_pending=OUTPUT_WRITER_MAX_PENDING):
+    # Yields submit(func, *args, **kwargs), which runs func on a writer thread. submit blocks
+    # while max_pending writes are outstanding; leaving the block waits for every write and
+    # re-raises the first error. Objects handed to submit must not be changed afterwards.
+    slots = threading.BoundedSemaphore(max_pending)
+    futures = []
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        def submit(func, *args, **kwargs):
+            slots.acquire()
+            future = executor.submit(func, *args, **kwargs)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        yield submit
+    for future in futures: future.result()
+
+def columnar_holdings(pages):
+    # Pages of holding objects -> parallel arrays; formattedValue is left to the client
+    holdings = [h for page in pages for h in page]
+    return {
+        "pageSize": ITEMS_PER_PAGE,
+        "name": [h["name"] for h in holdings],
+        "value": [h["value"] for h in holdings],
+        "percentage": [h["percentage"] for h in holdings],
+        "countryEmoji": [h["countryEmoji"] for h in holdings]
+    }
+
+def production_track(final_obj):
+    breakdown = {c_name: [{**{k: v for k, v in sub.items() if k != "holdingsPages"}, "holdings": columnar_holdings(sub["holdingsPages"])}
+                          if "holdingsPages" in sub else sub for sub in subs]
+                 for c_name, subs in final_obj["breakdown"].items()}
+    return {**final_obj, "breakdown": breakdown}
+
+CELL_TYPE_ERROR, CELL_TYPE_NUMERIC = "e", "n"  # openpyxl.cell.cell.TYPE_ERROR / TYPE_NUMERIC, without importing openpyxl
+
+def detect_header_row(rows):
+    for idx, row in enumerate(rows[:20]):
+        row_str = " ".join([str(x) for x in row])
+        if "מספר מסלול" in row_str: return idx
+    return 0
+
+def convert_cell(cell):
+    # Same cell conversion pandas applies in read_excel (openpyxl engine)
+    if cell.value is None: return ""
+    if cell.data_type == CELL_TYPE_ERROR: return np.nan
+    if cell.data_type == CELL_TYPE_NUMERIC:
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+def read_sheet_rows(ws):
+    ws.reset_dimensions()
+    rows = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(ws.rows):
+        converted = [convert_cell(cell) for cell in row]
+        while converted and converted[-1] == "": converted.pop()
+        if converted: last_row_with_data = row_number
+        rows.append(converted)
+    rows = rows[:last_row_with_data + 1]
+    if rows:
+        max_width = max(len(r) for r in rows)
+        rows = [r + [""] * (max_width - len(r)) for r in rows]
+    return rows
+
+def header_width(header):
+    # Columns up to the header's last named one; cells beyond it have no column name
+    width = len(header)
+    while width and header[width - 1] == "": width -= 1
+    return width
+
+def is_blank_row(row, width):
+    # The one blank-row rule of both readers: nothing under the header's columns. Blank rows
+    # (including openpyxl's empty padding rows) are skipped before rows are counted.
+    return all(v == "" for v in row[:width])
+
+def sheet_to_frame(ws):
+    # Single pass over the sheet: header detection runs on the rows already in memory
+    rows = read_sheet_rows(ws)
+    header_idx = detect_header_row(rows)
+    if rows:
+        width = header_width(rows[header_idx])
+        rows = rows[:header_idx + 1] + [row for row in rows[header_idx + 1:] if not is_blank_row(row, width)]
+    return pd.io.parsers.TextParser(rows, header=header_idx, skip_blank_lines=False).read()
+
+def sheet_to_chunks(ws, chunk_rows):
+    # Streaming counterpart of sheet_to_frame: yields DataFrames of up to chunk_rows rows,
+    # so only one batch of the sheet is in memory. Rows are cut to the header's width
+    # (the cells beyond it have no column name) and blank rows are skipped, as in sheet_to_frame.
+    ws.reset_dimensions()
+    rows = iter(ws.rows)
+    head = [[convert_cell(cell) for cell in row] for _, row in zip(range(20), rows)]
+    if not head: return
+    header_idx = detect_header_row(head)
+    width = header_width(head[header_idx])
+    header = head[header_idx][:width]
+    pending = []
+    for converted in itertools.chain(head[header_idx + 1:], ([convert_cell(cell) for cell in row[:width]] for row in rows)):
+        converted = converted[:width]
+        if is_blank_row(converted, width): continue
+        pending.append(converted + [""] * (width - len(converted)))
+        if len(pending) >= chunk_rows:
+            yield pd.io.parsers.TextParser([header] + pending, header=0, skip_blank_lines=False).read()
+            pending = []
+    if pending: yield pd.io.parsers.TextParser([header] + pending, header=0, skip_blank_lines=False).read()
+
+def iter_sheet_frames(workbook, stem, csv_dir=None, chunk_rows=None):
     try:
-        xls = pd.ExcelFile(file_path)
-        log(f"Splitting {file_path.name}...")
-        for sheet_name in xls.sheet_names:
+        for ws in workbook.worksheets:
+            sheet_label = f"{stem} - {ws.title}"
             try:
-                header_idx = detect_header_row(xls, sheet_name)
-                df = pd.read_excel(xls, sheet_name=sheet_name, header=header_idx)
-                csv_filename = f"{file_path.stem} - {sheet_name}.csv"
-                df.to_csv(target_dir / csv_filename, index=False, encoding='utf-8-sig')
-            except Exception as e: pass 
-        return True
+                frames = sheet_to_chunks(ws, chunk_rows) if chunk_rows else [sheet_to_frame(ws)]
+                for chunk_no, df in enumerate(frames):
+                    if csv_dir: df.to_csv(csv_dir / f"{sheet_label}.csv", index=False, encoding='utf-8-sig',
+                                          mode='a' if chunk_no else 'w', header=not chunk_no)
+                    yield sheet_label, df
+            except Exception: continue
+    finally:
+        workbook.close()
+
+def read_excel_sheets(file_path, csv_dir=None, chunk_rows=None):
+    # Returns a lazy (sheet_label, DataFrame) iterator, or None if the workbook can't be opened.
+    # csv_dir is optional debug output: each parsed sheet is also written there as CSV.
+    # With chunk_rows, large sheets arrive as several consecutive frames with the same label.
+    try:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
     except Exception as e:
         log(f"[!!] Error reading Excel: {e}")
-        return False
+        return None
+    log(f"Reading {file_path.name}...")
+    return iter_sheet_frames(workbook, file_path.stem, csv_dir, chunk_rows)
+
+def read_report_period(file_path):
+    # "YYYY-Qn" from the cover sheet's reporting quarter/year fields, or None if they aren't there
+    try:
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    except Exception: return None
+    fields = {}
+    try:
+        for row in itertools.islice(workbook.worksheets[0].iter_rows(values_only=True), 40):
+            cells = [c for c in row if c is not None and str(c).strip()]
+            if len(cells) < 2: continue
+            for label in [REPORT_QUARTER_LABEL, REPORT_YEAR_LABEL]:
+                if label in str(cells[0]):
+                    digits = re.sub(r"\D", "", str(cells[1]))
+                    if digits: fields[label] = int(digits)
+    finally:
+        workbook.close()
+    quarter, year = fields.get(REPORT_QUARTER_LABEL), fields.get(REPORT_YEAR_LABEL)
+    if not quarter or not year or not 1 <= quarter <= 4: return None
+    return f"{year}-Q{quarter}"
 
 # ==========================================
 # 3. CORE LOGIC
 # ==========================================
 
-def process_institution_data(target_dir, inst_key, config, master_map):
-    all_tracks_data = {} 
+def find_value_column(columns):
+    val_col = next((c for c in columns if "שווי" in c and "הוגן" in c and "באלפי" in c), None)
+    if not val_col: val_col = next((c for c in columns if "שווי" in c and "שוק" in c and "באלפי" in c), None)
+    if not val_col: val_col = next((c for c in columns if "שווי" in c and "הוגן" in c), None)
+    if not val_col: val_col = next((c for c in columns if "שווי" in c and "שוק" in c), None)
+    if not val_col: val_col = next((c for c in columns if "שווי" in c), None)
+    return val_col
+
+def coerce_track_id(raw_id):
+    try:
+        if pd.isna(raw_id) or str(raw_id).strip() in ['nan', 'ריק במקור']: return None
+        return str(int(float(raw_id)))
+    except: return None
+
+def isin_check_digit(body):
+    # Luhn over the digits of the ISIN body, letters counting as 10-35
+    digits = "".join(str(int(c, 36)) for c in body)
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        d = int(d) * (2 if i % 2 == 0 else 1)
+        total += d // 10 + d % 10
+    return str((10 - total % 10) % 10)
+
+def security_key(raw_id, id_type=None):
+    # Canonical security identifier, or "" when the row has none that other institutions share.
+    # TASE security numbers become their IL ISIN, so both spellings of one security match.
+    if not raw_id or (id_type and id_type in INTERNAL_SECURITY_ID_TYPES): return ""
+    text = re.sub(r"[\s_]+", " ", str(raw_id)).strip().upper()
+    number = re.fullmatch(r"(-?\d+)(?:\.0*)?", text)
+    if number:
+        if not 0 < int(number.group(1)) < 10**9: return ""
+        body = f"IL{int(number.group(1)):09d}"
+        return body + isin_check_digit(body)
+    return text if text not in ["NAN", "0"] else ""
+
+# --- Sheet Schemas ---
+# Every column lookup is resolved to a position once per distinct header (the stripped
+# column names) and shared by all sheets with that layout, in any institution.
+SCHEMA_CACHE = {}  # tuple of column names -> schema
+
+def resolve_sheet_schema(columns):
+    key = tuple(columns)
+    if key not in SCHEMA_CACHE:
+        first_position = {}
+        for pos, col in enumerate(columns): first_position.setdefault(col, pos)
+        positions = lambda names: [first_position[c] for c in names if c in first_position]
+        val_col = find_value_column(columns)
+        SCHEMA_CACHE[key] = {
+            "track": first_position.get('מספר מסלול'),
+            "value": first_position.get(val_col) if val_col else None,
+            "class": first_position.get("סיווג הקרן"),
+            "trackName": positions(TRACK_NAME_COLUMNS),
+            "name": positions(NAME_COLUMNS),
+            "country": positions(COUNTRY_COLUMNS),
+            "general": positions(GENERAL_LOCATION_COLUMNS),
+            "currency": positions(CURRENCY_COLUMNS),
+            "sector": positions(SECTOR_COLUMNS),
+            "security": positions(SECURITY_ID_COLUMNS),
+            "securityType": positions(SECURITY_ID_TYPE_COLUMNS)
+        }
+    return SCHEMA_CACHE[key]
+
+def register_track(track_id, values, schema, inst_tracks_config, master_map):
+    if track_id in master_map: inst_tracks_config[track_id] = master_map[track_id]
+    elif track_id not in inst_tracks_config:
+        found_name = get_column_value(values, schema["trackName"])
+        inst_tracks_config[track_id] = found_name if found_name else f"Unknown Track {track_id}"
+
+# --- Holding Store ---
+# One row table per institution: every string field is interned to an int index into
+# "strings", and each field is a typed array, so a line item costs 40 bytes instead of a dict.
+HOLDING_STORE_FIELDS = ["track", "cls", "sub", "name", "emoji", "currency", "sector", "security"]
+
+def new_holding_store():
+    return {"strings": [], "ids": {}, "codes": {field: array('i') for field in HOLDING_STORE_FIELDS}, "value": array('d')}
+
+def add_holding(store, track_id, cls, sub, name, val_bn, emoji, currency, sector, security=""):
+    strings, ids, codes = store["strings"], store["ids"], store["codes"]
+    for field, text in zip(HOLDING_STORE_FIELDS, (track_id, cls, sub, name, emoji, currency, sector, security)):
+        code = ids.get(text)
+        if code is None:
+            code = ids[text] = len(strings)
+            strings.append(text)
+        codes[field].append(code)
+    store["value"].append(val_bn)
+
+# --- Holdings Table (holdings_table/institution=<key>/) ---
+# Every kept line item as one columnar table, partitioned by institution (hive-style directories).
+# String columns are dictionary-encoded against the store's intern table. Written as Parquet when
+# pyarrow is installed; otherwise as one .npy file per column plus strings.json, which
+# read_holdings_table memory-maps.
+HOLDINGS_TABLE_COLUMNS = {"track": "trackId", "cls": "assetClass", "sub": "subclass", "name": "name",
+                          "emoji": "emoji", "currency": "currency", "sector": "sector", "security": "securityId"}
+
+def write_holdings_table(store, inst_key, table_dir):
+    partition = table_dir / f"institution={inst_key}"
+    shutil.rmtree(partition, ignore_errors=True)
+    partition.mkdir(parents=True)
+    codes = {field: np.frombuffer(store["codes"][field], dtype=np.intc) for field in HOLDING_STORE_FIELDS}
+    values = np.frombuffer(store["value"], dtype=np.float64)
+    if PYARROW_AVAILABLE:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        columns = {}
+        for field, column in HOLDINGS_TABLE_COLUMNS.items():
+            # Each column gets a dictionary of only the strings it uses, not the partition's whole string table
+            used, column_codes = np.unique(codes[field], return_inverse=True)
+            dictionary = pa.array([store["strings"][i] for i in used], type=pa.string())
+            columns[column] = pa.DictionaryArray.from_arrays(pa.array(column_codes, type=pa.int32()), dictionary)
+        pq.write_table(pa.table({**columns, "value": pa.array(values)}), partition / "part-0.parquet")
+    else:
+        for field, column in HOLDINGS_TABLE_COLUMNS.items(): np.save(partition / f"{column}.npy", codes[field].astype(np.int32))
+        np.save(partition / "value.npy", values)
+        with open(partition / "strings.json", 'w', encoding='utf-8') as f:
+            json.dump(store["strings"], f, ensure_ascii=False)
+    return len(values)
+
+def read_holdings_table(table_dir=None, institutions=None):
+    # All (or the named) institutions' line items as one DataFrame with categorical string columns
+    table_dir = Path(table_dir or HOLDINGS_TABLE_DIRECTORY)
+    frames = []
+    for partition in sorted(table_dir.glob("institution=*")):
+        inst_key = partition.name.split("=", 1)[1]
+        if institutions and inst_key not in institutions: continue
+        if (partition / "part-0.parquet").exists():
+            if not PYARROW_AVAILABLE: raise ImportError(f"pyarrow is needed to read {partition / 'part-0.parquet'}")
+            import pyarrow.parquet as pq
+            df = pq.read_table(partition / "part-0.parquet", memory_map=True).to_pandas()
+        else:
+            with open(partition / "strings.json", 'r', encoding='utf-8') as f:
+                strings = json.load(f)
+            df = pd.DataFrame({column: pd.Categorical.from_codes(np.load(partition / f"{column}.npy", mmap_mode='r'), categories=strings)
+                               for column in HOLDINGS_TABLE_COLUMNS.values() if (partition / f"{column}.npy").exists()})
+            df["value"] = np.load(partition / "value.npy", mmap_mode='r')
+        # .npy codes (and older Parquet files) index the partition's shared string table
+        for column in HOLDINGS_TABLE_COLUMNS.values():
+            if column in df: df[column] = df[column].cat.remove_unused_categories()
+        df.insert(0, "institution", inst_key)
+        frames.append(df)
+    if not frames: return pd.DataFrame(columns=["institution", *HOLDINGS_TABLE_COLUMNS.values(), "value"])
+    df = pd.concat(frames, ignore_index=True)
+    # Partitions written before a column existed lack it; those rows read as missing
+    for column in ["institution", *HOLDINGS_TABLE_COLUMNS.values()]:
+        if column in df: df[column] = df[column].astype("category")
+    return df
+
+def is_bond_etf(class_val):
+    c_val = str(class_val)
+    return "אג\"ח" in c_val or "אג”ח" in c_val
+
+def process_rows(df, schema, default_cls, default_sub, is_etf_file, inst_tracks_config, master_map, all_tracks_data, add=add_holding):
+    # Returns row counts: {"kept": n, "dropped": {reason: n}}
+    kept, dropped = 0, {"noTrackId": 0, "zeroValue": 0}
+    class_pos = schema["class"]
+    # to_numpy() rows hold the same values iterrows() would (all-numeric sheets are upcast alike)
+    for values in df.to_numpy():
+        track_id = coerce_track_id(values[schema["track"]])
+        if track_id is None:
+            dropped["noTrackId"] += 1
+            continue
+        register_track(track_id, values, schema, inst_tracks_config, master_map)
+        
+        val = clean_value(values[schema["value"]])
+        val_bn = val / 1_000_000.0
+        if abs(val_bn) < 1e-12:
+            dropped["zeroValue"] += 1
+            continue 
+        
+        raw_name = get_column_value(values, schema["name"])
+        cls, sub = default_cls, default_sub
+        if is_etf_file and class_pos is not None and is_bond_etf(values[class_pos]): cls, sub = "Bonds", "ETFs"
+
+        emoji, currency, sector = classify_holding(
+            get_column_value(values, schema["country"]), raw_name, get_column_value(values, schema["general"]),
+            get_column_value(values, schema["currency"]), get_column_value(values, schema["sector"]), cls)
+        security = security_key(get_column_value(values, schema["security"]), get_column_value(values, schema["securityType"]))
+        add(all_tracks_data, track_id, cls, sub, raw_name or "Unknown Asset", val_bn, emoji, currency, sector, security)
+        kept += 1
+    return {"kept": kept, "dropped": dropped}
+
+# --- Columnar Engine ---
+# Same rules as process_rows, applied to whole columns. Scalar helpers run once
+# per distinct value (or distinct combination of inputs) instead of once per row.
+
+def map_distinct(series, func):
+    if isinstance(series.dtype, pd.StringDtype) or (pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)):
+        codes, uniques = pd.factorize(series)
+        results = np.empty(len(uniques) + 1, dtype=object)
+        results[:-1] = [func(u) for u in uniques]
+        results[-1] = func(np.nan) # code -1 marks missing values
+        return pd.Series(results[codes], index=series.index, dtype=object)
+    return series.map(func).astype(object)
+
+def get_column_values(df, positions):
+    # Column-wise get_column_value: first usable value per row, else None
+    result = pd.Series(None, index=df.index, dtype=object)
+    for pos in positions:
+        column = df.iloc[:, pos]
+        pending = result.isna() & column.notna()
+        if not pending.any(): continue
+        vals = column[pending].map(lambda v: str(v).strip())
+        vals = vals[~vals.isin(['nan', 'ריק במקור'])]
+        result[vals.index] = vals
+    return result
+
+def map_combinations(func, *columns):
+    cache = {}
+    out = []
+    for key in zip(*columns):
+        if key not in cache: cache[key] = func(*key)
+        out.append(cache[key])
+    return out
+
+def process_columns(df, schema, default_cls, default_sub, is_etf_file, inst_tracks_config, master_map, all_tracks_data, add=add_holding):
+    track_ids = map_distinct(df.iloc[:, schema["track"]], coerce_track_id)
+    valid = track_ids.notna()
+    for idx, track_id in track_ids[valid].drop_duplicates().items():
+        register_track(track_id, df.loc[idx].to_numpy(), schema, inst_tracks_config, master_map)
+
+    vals_bn = map_distinct(df.iloc[:, schema["value"]], clean_value).astype(float) / 1_000_000.0
+    keep = valid & ~(vals_bn.abs() < 1e-12)
+    counts = {"kept": int(keep.sum()), "dropped": {"noTrackId": int((~valid).sum()), "zeroValue": int((valid & ~keep).sum())}}
+    if not keep.any(): return counts
+    df = df[keep]
+    track_ids, vals_bn = track_ids[keep], vals_bn[keep]
+
+    raw_names = get_column_values(df, schema["name"])
+    names = raw_names.map(lambda n: n or "Unknown Asset")
+    classes = pd.Series(default_cls, index=df.index, dtype=object)
+    subs = pd.Series(default_sub, index=df.index, dtype=object)
+    if is_etf_file and schema["class"] is not None:
+        bond_mask = map_distinct(df.iloc[:, schema["class"]], is_bond_etf).astype(bool)
+        classes[bond_mask], subs[bond_mask] = "Bonds", "ETFs"
+
+    classified = map_combinations(classify_holding, get_column_values(df, schema["country"]), raw_names, get_column_values(df, schema["general"]),
+                                  get_column_values(df, schema["currency"]), get_column_values(df, schema["sector"]), classes)
+    securities = map_combinations(security_key, get_column_values(df, schema["security"]), get_column_values(df, schema["securityType"]))
+
+    for row, (emoji, currency, sector), security in zip(zip(track_ids, classes, subs, names, vals_bn.tolist()), classified, securities):
+        add(all_tracks_data, *row, emoji, currency, sector, security)
+    return counts
+
+def timed(iterable):
+    # Yields (seconds spent producing the item, item); times the lazy sheet reader
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try: item = next(iterator)
+        except StopIteration: return
+        yield time.perf_counter() - start, item
+
+def process_institution_data(sheets, inst_key, config, master_map, engine="columnar", report=None, profilers=None, streaming=False, table_dir=None):
+    # Returns track_id -> track aggregate (see new_track_aggregate).
+    # table_dir: also write the line items to the holdings table (not available when streaming,
+    # which keeps no line items).
+    # streaming: line items are folded into the aggregates as they are classified instead of
+    # being kept until every sheet is read, so memory follows distinct holdings, not rows.
+    # report (optional) receives "stages" (read/classify seconds) and a "sheets" list with
+    # per-sheet timings, row counts, the traced peak while reading and classifying the sheet
+    # (when tracemalloc is tracing) and, for skipped sheets, the reason
+    all_tracks_data = {} if streaming else new_holding_store()
+    add = accumulate_holding if streaming else add_holding
+    timings = report.setdefault("stages", {}) if report is not None else {}
+    sheet_reports = report.setdefault("sheets", []) if report is not None else []
     
     if inst_key not in config['institutions']:
         config['institutions'][inst_key] = { "name": inst_key.replace("_", " "), "tracks": {} }
     
     inst_tracks_config = config['institutions'][inst_key]["tracks"]
-    csv_files = list(target_dir.glob("*.csv"))
 
-    log(f"Scanning {len(csv_files)} CSVs...")
+    log(f"Scanning sheets ({engine} engine)...")
 
-    for f in csv_files:
-        if any(x in f.name for x in ["מיפוי סעיפים", "File Name Info", "סכום נכסים", "עמוד פתיחה"]): continue
-        default_cls, default_sub = get_category(f.name)
-        is_etf_file = "קרנות סל" in f.name
-        
-        try:
-            df = pd.read_csv(f)
-            df.columns = [c.strip() for c in df.columns]
-            if 'מספר מסלול' not in df.columns: continue
-            
-            val_col = next((c for c in df.columns if "שווי" in c and "הוגן" in c and "באלפי" in c), None)
-            if not val_col: val_col = next((c for c in df.columns if "שווי" in c and "שוק" in c and "באלפי" in c), None)
-            if not val_col: val_col = next((c for c in df.columns if "שווי" in c and "הוגן" in c), None)
-            if not val_col: val_col = next((c for c in df.columns if "שווי" in c and "שוק" in c), None)
-            if not val_col: val_col = next((c for c in df.columns if "שווי" in c), None)
-            
-            if not val_col: continue 
-            class_col = "סיווג הקרן" if "סיווג הקרן" in df.columns else None
-
-            for _, row in df.iterrows():
-                try:
-                    raw_id = row['מספר מסלול']
-                    if pd.isna(raw_id) or str(raw_id).strip() in ['nan', 'ריק במקור']: continue
-                    track_id = str(int(float(raw_id)))
-                except: continue
-                
-                if track_id in master_map: inst_tracks_config[track_id] = master_map[track_id]
-                elif track_id not in inst_tracks_config:
-                    found_name = get_column_value(row, TRACK_NAME_COLUMNS)
-                    inst_tracks_config[track_id] = found_name if found_name else f"Unknown Track {track_id}"
-                
-                val = clean_value(row[val_col])
-                val_bn = val / 1_000_000.0
-                if abs(val_bn) < 1e-12: continue 
-                
-                name = get_column_value(row, NAME_COLUMNS) or "Unknown Asset"
-                cls, sub = default_cls, default_sub
-                if is_etf_file and class_col:
-                    c_val = str(row[class_col])
-                    if "אג\"ח" in c_val or "אג”ח" in c_val: cls, sub = "Bonds", "ETFs"
-
-                emoji = get_country_emoji(row, cls) 
-                currency = detect_currency(row, emoji, name)
-                sector = get_sector(row, cls)
-
-                if track_id not in all_tracks_data: all_tracks_data[track_id] = {}
-                if cls not in all_tracks_data[track_id]: all_tracks_data[track_id][cls] = {}
-                if sub not in all_tracks_data[track_id][cls]: all_tracks_data[track_id][cls][sub] = []
-                
-                all_tracks_data[track_id][cls][sub].append({
-                    "name": name, 
-                    "value": val_bn,
-                    "emoji": emoji,
-                    "currency": currency,
-                    "sector": sector
-                })
-        except Exception: pass 
-    return all_tracks_data
-
-def calculate_geo_sunburst(data_store):
-    country_groups = {} 
-    for cls_name, subclasses in data_store.items():
-        for sub_items in subclasses.values():
-            for item in sub_items:
-                emoji = item.get("emoji", "")
-                country_key = emoji if emoji else "Other"
-                if country_key not in country_groups: country_groups[country_key] = {}
-                if cls_name not in country_groups[country_key]: country_groups[country_key][cls_name] = 0.0
-                country_groups[country_key][cls_name] += abs(item["value"]) 
+    read_profiler = profilers.setdefault("read", cProfile.Profile()) if profilers is not None else None
+    if read_profiler: read_profiler.enable()
+    for read_seconds, (sheet_label, df) in timed(sheets):
+        if read_profiler: read_profiler.disable()
+        timings["read"] = round(timings.get("read", 0.0) + read_seconds, 6)
+        sheet_report = {"sheet": sheet_label, "readSeconds": round(read_seconds, 6), "rowsRead": len(df)}
+        sheet_timings = {}
+        with stage(sheet_timings, "classify", profilers):
+            sheet_report["skipped"] = classify_sheet(sheet_label, df, engine, inst_tracks_config, master_map, all_tracks_data, sheet_report, add)
+        timings["classify"] = round(timings.get("classify", 0.0) + sheet_timings["classify"], 6)
+        sheet_report["classifySeconds"] = sheet_timings["classify"]
+        if sheet_report["skipped"] is None: del sheet_report["skipped"]
+        peak = traced_peak_mb()
+        if peak is not None: sheet_report["peakAllocatedMB"] = peak
+        # Streamed sheets arrive in chunks; report them as one sheet
+        if sheet_reports and sheet_reports[-1]["sheet"] == sheet_label: merge_sheet_report(sheet_reports[-1], sheet_report)
+        else: sheet_reports.append(sheet_report)
+        if read_profiler: read_profiler.enable()
+    if read_profiler: read_profiler.disable()
 
-    sunburst_data = []
-    for country_key, assets_dict in country_groups.items():
-        asset_children = []
-        children_sum = 0.0
-        for cls_name, abs_val in assets_dict.items():
-            if abs_val > 1e-12:
-                asset_children.append({ "name": cls_name, "value": round(abs_val, 9), "formattedValue": format_currency(abs_val) })
-                children_sum += abs_val
-        if not asset_children: continue
-        asset_children.sort(key=lambda x: x["value"], reverse=True)
-        display_name = EMOJI_TO_NAME.get(country_key, "Global" if country_key == "Other" else country_key)
-        sunburst_data.append({ "name": display_name, "value": round(children_sum, 9), "formattedValue": format_currency(children_sum), "children": asset_children })
-    sunburst_data.sort(key=lambda x: x["value"], reverse=True)
-    return sunburst_data
+    if table_dir and not streaming:
+        with stage(timings, "holdingsTable", profilers):
+            rows = write_holdings_table(all_tracks_data, inst_key, table_dir)
+        if report is not None: report["holdingsTableRows"] = rows
+
+    with stage(timings, "aggregate", profilers):
+        if streaming: return {t_id: finalize_track_aggregate(agg) for t_id, agg in all_tracks_data.items()}
+        return aggregate_holding_store(all_tracks_data)
+
+def merge_sheet_report(target, chunk):
+    for key in ["readSeconds", "classifySeconds", "rowsRead", "rowsKept"]:
+        if key in chunk: target[key] = round(target.get(key, 0) + chunk[key], 6)
+    if "peakAllocatedMB" in chunk: target["peakAllocatedMB"] = max(target.get("peakAllocatedMB", 0), chunk["peakAllocatedMB"])
+    for reason, n in chunk.get("rowsDropped", {}).items():
+        target.setdefault("rowsDropped", {})[reason] = target["rowsDropped"].get(reason, 0) + n
+
+def classify_sheet(sheet_label, df, engine, inst_tracks_config, master_map, all_tracks_data, sheet_report, add=add_holding):
+    # Adds the sheet's holdings to all_tracks_data and its row counts to sheet_report.
+    # Returns why the sheet was skipped, or None.
+    if any(x in sheet_label for x in ["מיפוי סעיפים", "File Name Info", "סכום נכסים", "עמוד פתיחה"]): return "excluded sheet"
+    default_cls, default_sub = get_category(sheet_label)
+    is_etf_file = "קרנות סל" in sheet_label
+    
+    try:
+        df.columns = [str(c).strip() for c in df.columns]
+        schema = resolve_sheet_schema(df.columns)
+        if schema["track"] is None: return "no track column"
+        if schema["value"] is None: return "no value column"
+
+        # Duplicate headers and all-numeric sheets keep row-level quirks, so leave them to the row engine
+        use_rows = engine == "rows" or df.columns.duplicated().any() or df.select_dtypes(exclude="number").empty
+        process_file = process_rows if use_rows else process_columns
+        counts = process_file(df, schema, default_cls, default_sub, is_etf_file, inst_tracks_config, master_map, all_tracks_data, add)
+        sheet_report["rowsKept"] = counts["kept"]
+        sheet_report["rowsDropped"] = counts["dropped"]
+    except Exception as e: return f"error: {e}"
+    return None
+
+def new_track_aggregate():
+    # classes:    class -> {"net", "abs", "subclasses": subclass -> {"net", "abs", "grouped": name -> net, "emojis": name -> emoji}}
+    # countries:  country emoji ("Other" if none) -> class -> abs
+    # currencies: currency -> class -> abs
+    # sectors:    class -> sector -> abs
+    # securities: name -> the first security identifier seen for it in the track
+    return {"total": 0, "classes": {}, "countries": {}, "currencies": {}, "sectors": {}, "securities": {}}
+
+def accumulate_holding(track_aggregates, track_id, cls, sub, name, val_bn, emoji, currency, sector, security=""):
+    # Same signature as add_holding, but folds the line item into its track's aggregate
+    # instead of keeping it. Class and track totals are filled in by finalize_track_aggregate.
+    agg = track_aggregates.get(track_id)
+    if agg is None: agg = track_aggregates[track_id] = new_track_aggregate()
+    subclasses = agg["classes"].setdefault(cls, {"net": 0, "abs": 0, "subclasses": {}})["subclasses"]
+    s_agg = subclasses.get(sub)
+    if s_agg is None: s_agg = subclasses[sub] = {"net": 0, "abs": 0, "grouped": {}, "emojis": {}}
+    abs_value = abs(val_bn)
+    s_agg["net"] += val_bn
+    s_agg["abs"] += abs_value
+    grouped = s_agg["grouped"]
+    grouped[name] = grouped.get(name, 0) + val_bn
+    if emoji: s_agg["emojis"][name] = emoji
+    country = agg["countries"].setdefault(emoji or "Other", {})
+    country[cls] = country.get(cls, 0.0) + abs_value
+    by_currency = agg["currencies"].setdefault(currency, {})
+    by_currency[cls] = by_currency.get(cls, 0.0) + abs_value
+    cls_sectors = agg["sectors"].setdefault(cls, {})
+    cls_sectors[sector] = cls_sectors.get(sector, 0.0) + abs_value
+    if security and name not in agg["securities"]: agg["securities"][name] = security
+
+def finalize_track_aggregate(agg):
+    # Class and track totals are sums of subclass totals, in subclass order
+    total = 0
+    for c_agg in agg["classes"].values():
+        c_net = c_abs = 0
+        for s_agg in c_agg["subclasses"].values():
+            c_net += s_agg["net"]
+            c_abs += s_agg["abs"]
+            total += s_agg["net"]
+        c_agg["net"], c_agg["abs"] = c_net, c_abs
+    agg["total"] = total
+    return agg
+
+def first_seen_codes(*keys):
+    # Codes for each distinct combination of the int key arrays, numbered by first appearance
+    combined = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        combined = pd.factorize(combined * (int(key.max()) + 1) + key)[0].astype(np.int64)
+    return combined
 
-def calculate_currency_sunburst(data_store):
-    currency_groups = {} 
-    for cls_name, subclasses in data_store.items():
-        for sub_items in subclasses.values():
-            for item in sub_items:
-                curr = item.get("currency", "ILS")
-                if curr not in currency_groups: currency_groups[curr] = {}
-                if cls_name not in currency_groups[curr]: currency_groups[curr][cls_name] = 0.0
-                currency_groups[curr][cls_name] += abs(item["value"]) 
+def aggregate_holding_store(store):
+    # Builds every track's aggregate (see new_track_aggregate) from the store with array ops.
+    # Rows are stably sorted into track -> class -> subclass order, each by first appearance
+    # like the nested dicts this store replaced, and np.bincount adds them one by one in that
+    # order. Every sum therefore matches accumulate_holding over the same items bit for bit.
+    if not len(store["value"]): return {}
+    strings = store["strings"]
+    codes = {field: np.asarray(store["codes"][field]) for field in HOLDING_STORE_FIELDS}
+    values = np.asarray(store["value"])
+    truthy = np.array([bool(text) for text in strings])
+    # The first identifier seen for a name within its track, in input order like accumulate_holding
+    has_security = truthy[codes["security"]]
+    securities = pd.DataFrame({field: codes[field][has_security] for field in ["track", "name", "security"]}).drop_duplicates(["track", "name"])
+    track_key = first_seen_codes(codes["track"])
+    class_key = first_seen_codes(track_key, codes["cls"])
+    sub_key = first_seen_codes(class_key, codes["sub"])
+    order = np.lexsort((sub_key, class_key, track_key))
+    codes = {field: code[order] for field, code in codes.items()}
+    values, sub_key = values[order], sub_key[order]
+    abs_values = np.abs(values)
 
+    def sums(key, weights):
+        # (first row of each key, per-key sum) in key order
+        return np.unique(key, return_index=True)[1], np.bincount(key, weights=weights).tolist()
+
+    track_aggregates = {}
+    sub_first, sub_net = sums(sub_key, values)
+    sub_abs = np.bincount(sub_key, weights=abs_values).tolist()
+    subclass_aggs = []
+    for k, row in enumerate(sub_first.tolist()):
+        agg = track_aggregates.get(strings[codes["track"][row]])
+        if agg is None: agg = track_aggregates[strings[codes["track"][row]]] = new_track_aggregate()
+        cls = strings[codes["cls"][row]]
+        subclasses = agg["classes"].setdefault(cls, {"net": 0, "abs": 0, "subclasses": {}})["subclasses"]
+        subclass_aggs.append(subclasses.setdefault(strings[codes["sub"][row]], {"net": sub_net[k], "abs": sub_abs[k], "grouped": {}, "emojis": {}}))
+
+    name_key = first_seen_codes(sub_key, codes["name"])
+    name_first, name_net = sums(name_key, values)
+    for k, row in enumerate(name_first.tolist()):
+        subclass_aggs[sub_key[row]]["grouped"][strings[codes["name"][row]]] = name_net[k]
+    # The last non-empty emoji seen for a name within its subclass wins
+    has_emoji = truthy[codes["emoji"]]
+    last_emoji = pd.Series(codes["emoji"][has_emoji]).groupby(name_key[has_emoji]).last()
+    for key, emoji in zip(last_emoji.index.tolist(), last_emoji.tolist()):
+        row = name_first[key]
+        subclass_aggs[sub_key[row]]["emojis"][strings[codes["name"][row]]] = strings[emoji]
+
+    # Exposure rings: (track, group, class) sums, or (track, class, sector) for sectors
+    other = len(strings)  # "Other" stands in for rows without a country emoji
+    country_codes = np.where(has_emoji, codes["emoji"], other)
+    track_codes = codes["track"]
+    for section, outer, inner in [("countries", country_codes, codes["cls"]),
+                                  ("currencies", codes["currency"], codes["cls"]),
+                                  ("sectors", codes["cls"], codes["sector"])]:
+        key = first_seen_codes(track_codes, outer, inner)
+        first, totals = sums(key, abs_values)
+        for k, row in enumerate(first.tolist()):
+            group_name = "Other" if outer[row] == other else strings[outer[row]]
+            groups = track_aggregates[strings[track_codes[row]]][section].setdefault(group_name, {})
+            groups[strings[inner[row]]] = totals[k]
+    for track, name, security in securities.itertuples(index=False):
+        track_aggregates[strings[track]]["securities"][strings[name]] = strings[security]
+
+    for agg in track_aggregates.values(): finalize_track_aggregate(agg)
+    return track_aggregates
+
+def build_sunburst(groups, display_name=lambda key: key):
+    # groups: outer -> inner -> abs value; rings drop slices that round to nothing
     sunburst_data = []
-    for curr, assets_dict in currency_groups.items():
-        asset_children = []
+    for key, inner in groups.items():
+        children = []
         children_sum = 0.0
-        for cls_name, abs_val in assets_dict.items():
+        for inner_name, abs_val in inner.items():
             if abs_val > 1e-12:
-                asset_children.append({ "name": cls_name, "value": round(abs_val, 9), "formattedValue": format_currency(abs_val) })
+                children.append({ "name": inner_name, "value": round(abs_val, 9), "formattedValue": format_currency(abs_val) })
                 children_sum += abs_val
-        if not asset_children: continue
-        asset_children.sort(key=lambda x: x["value"], reverse=True)
-        sunburst_data.append({ "name": curr, "value": round(children_sum, 9), "formattedValue": format_currency(children_sum), "children": asset_children })
+        if not children: continue
+        children.sort(key=lambda x: x["value"], reverse=True)
+        sunburst_data.append({ "name": display_name(key), "value": round(children_sum, 9), "formattedValue": format_currency(children_sum), "children": children })
     sunburst_data.sort(key=lambda x: x["value"], reverse=True)
     return sunburst_data
 
-def calculate_sector_sunburst(data_store):
-    class_groups = {} 
-    for cls_name, subclasses in data_store.items():
-        for sub_items in subclasses.values():
-            for item in sub_items:
-                sec = item.get("sector", "General")
-                if cls_name not in class_groups: class_groups[cls_name] = {}
-                if sec not in class_groups[cls_name]: class_groups[cls_name][sec] = 0.0
-                class_groups[cls_name][sec] += abs(item["value"])
+def country_display_name(key):
+    return EMOJI_TO_NAME.get(key, "Global" if key == "Other" else key)
 
-    sunburst_data = []
-    for cls_name, sectors_dict in class_groups.items():
-        sector_children = []
-        class_total_exposure = 0.0
-        for sec_name, val in sectors_dict.items():
-            if val > 1e-12:
-                sector_children.append({ "name": sec_name, "value": round(val, 9), "formattedValue": format_currency(val) })
-                class_total_exposure += val
-        if not sector_children: continue
-        sector_children.sort(key=lambda x: x["value"], reverse=True)
-        sunburst_data.append({ "name": cls_name, "value": round(class_total_exposure, 9), "formattedValue": format_currency(class_total_exposure), "children": sector_children })
-    sunburst_data.sort(key=lambda x: x["value"], reverse=True)
-    return sunburst_data
+def calculate_geo_sunburst(aggregate):
+    return build_sunburst(aggregate["countries"], country_display_name)
+
+def calculate_currency_sunburst(aggregate):
+    return build_sunburst(aggregate["currencies"])
+
+def calculate_sector_sunburst(aggregate):
+    return build_sunburst(aggregate["sectors"])
+
+def track_exposures(aggregate, geo_sunburst_data, currency_sunburst_data, sector_sunburst_data):
+    # Percent of the track's assets: net per asset class, gross (as in the sunbursts) for the rest.
+    # The sector sunburst is class -> sector, so sectors are summed over its inner ring.
+    total_assets = aggregate["total"]
+    shares = {dim: {} for dim in EXPOSURE_DIMENSIONS}
+
+    def add(dim, label, value):
+        shares[dim][label] = shares[dim].get(label, 0.0) + value / total_assets * 100
+
+    for c_name, c_agg in aggregate["classes"].items(): add("assetClasses", c_name, c_agg["net"])
+    for item in geo_sunburst_data:
+        add("countries", item["name"], item["value"])
+        for child in item["children"]: add("countryAssetClasses", f"{item['name']} / {child['name']}", child["value"])
+    for item in currency_sunburst_data: add("currencies", item["name"], item["value"])
+    for item in sector_sunburst_data:
+        for child in item["children"]: add("sectors", child["name"], child["value"])
+    return {dim: {label: round(pct, 2) for label, pct in values.items() if round(pct, 2) != 0} for dim, values in shares.items()}
+
+# --- Holdings Matrix ---
+# File layout: {"tracks": [track id, ...], <dimension>: {"labels", "offsets", "ids", "percentages"}, ...}.
+# Each dimension is stored CSR-style: track i's entries are ids/percentages[offsets[i]:offsets[i + 1]],
+# ids indexing labels (holding, asset class, country, currency or sector names, by dimension). Holdings are deduplicated by normalized name within the institution;
+# the dashboard and the similarity index join institutions on the same normalized name.
+# holdings["securities"] runs parallel to holdings["labels"]: each holding's security identifier, or "".
+
+def new_sparse_matrix():
+    return {"labels": [], "offsets": [0], "ids": [], "percentages": [], "index": {}}
+
+def new_holdings_matrix():
+    return {"tracks": [], "securities": {}, **{dim: new_sparse_matrix() for dim in HOLDINGS_MATRIX_DIMENSIONS}}
 
-def generate_jsons(target_dir, all_tracks_data, inst_key, config):
+def matrix_key(dim, label):
+    return (normalize_search_text(label) or label) if dim == "holdings" else label
+
+def matrix_label_id(matrix, dim, label):
+    sparse, key = matrix[dim], matrix_key(dim, label)
+    if key not in sparse["index"]:
+        sparse["index"][key] = len(sparse["labels"])
+        sparse["labels"].append(label)
+    return sparse["index"][key]
+
+def add_matrix_row(matrix, track_id, values, total_assets):
+    # values: dim -> label id -> net value (billions) summed over the track
+    for dim in HOLDINGS_MATRIX_DIMENSIONS:
+        sparse = matrix[dim]
+        for label_id in sorted(values[dim]):
+            pct = round(values[dim][label_id] / total_assets * 100, HOLDINGS_MATRIX_DECIMALS)
+            if pct == 0: continue
+            sparse["ids"].append(label_id)
+            sparse["percentages"].append(pct)
+        sparse["offsets"].append(len(sparse["ids"]))
+    matrix["tracks"].append(track_id)
+
+def matrix_json(matrix):
+    result = {key: {k: v for k, v in value.items() if k != "index"} if key in HOLDINGS_MATRIX_DIMENSIONS else value
+              for key, value in matrix.items() if key != "securities"}
+    result["holdings"]["securities"] = [matrix["securities"].get(i, "") for i in range(len(result["holdings"]["labels"]))]
+    return result
+
+def generate_jsons(target_dir, track_aggregates, inst_key, config, search_index, output_options=None):
+    # output_options["lazy_holdings"]: keep holdingsPages out of the track JSON and write each
+    # subclass's pages to holdings/<track>/<class>_<subclass>.json, referenced by "holdingsFile"
+    # output_options["production"]: minified JSON, columnar holdings, .gz/.br siblings
+    # Files are serialized and written by output_writer threads while the next tracks are built;
+    # every file is on disk when this returns.
+    with output_writer() as submit:
+        return build_track_jsons(target_dir, track_aggregates, inst_key, config, search_index, output_options, submit)
+
+def build_track_jsons(target_dir, track_aggregates, inst_key, config, search_index, output_options, submit):
+    output_options = output_options or {}
+    production = output_options.get("production", False)
+    output_bytes = {}
     track_map = config['institutions'][inst_key]['tracks']
     manifest_entries = []
     inst_total_aum = 0.0
     inst_name = config['institutions'][inst_key].get("name", inst_key)
+    matrix = new_holdings_matrix()
+    exposures = {}
 
-    for t_id, data_store in all_tracks_data.items():
+    for t_id, aggregate in track_aggregates.items():
         t_name = track_map.get(t_id, f"Track {t_id}")
-        total_assets = sum(sum(i['value'] for i in s) for c in data_store.values() for s in c.values())
+        safe_filename = get_safe_filename(t_name)
+        total_assets = aggregate["total"]
         if total_assets == 0: continue
         inst_total_aum += total_assets
 
         # Add to Search Index: Tracks
-        track_ref = len(GLOBAL_SEARCH_INDEX["tracks"])
-        GLOBAL_SEARCH_INDEX["tracks"].append({
+        track_ref = len(search_index["tracks"])
+        search_index["tracks"].append({
             "id": t_id,
             "name": t_name,
             "instName": inst_name,
             "instDir": inst_key,
-            "file": get_safe_filename(t_name),
+            "file": safe_filename,
             "aum": format_currency(total_assets)
         })
 
         asset_classes = []
         breakdown = {}
-        
-        # Calculate TOTAL NET ASSETS for Main Pie percentages
-        total_net_value_all = sum(sum(i['value'] for i in s) for c in data_store.values() for s in c.values())
+        matrix_values = {dim: {} for dim in HOLDINGS_MATRIX_DIMENSIONS}
+        if output_options.get("lazy_holdings"):
+            holdings_dir = Path("holdings") / safe_filename[:-len(".json")]
+            (target_dir / holdings_dir).mkdir(parents=True, exist_ok=True)
+            holdings_written = set()
 
-        for c_name, subs in data_store.items():
-            # Calculate NET sum for this asset class
-            c_net = sum(sum(i['value'] for i in s_list) for s_list in subs.values())
+        for c_idx, (c_name, c_agg) in enumerate(aggregate["classes"].items()):
+            c_net = c_agg["net"]
             
             # --- FIX: Main Pie uses ABSOLUTE value for Slice Size to show magnitude of negative classes ---
             # But we keep Signed Value for Text Label
             c_abs = abs(c_net)
             
             # Percentage based on NET TOTAL (Standard accounting)
-            c_pct = (c_net / total_net_value_all) * 100 if total_net_value_all != 0 else 0
+            c_pct = (c_net / total_assets) * 100 if total_assets != 0 else 0
+            matrix_values["assetClasses"][matrix_label_id(matrix, "assetClasses", c_name)] = c_net
             
             asset_classes.append({
                 "name": c_name, 
@@ -493,41 +1370,38 @@ def generate_jsons(target_dir, all_tracks_data, inst_key, config):
             })
             
             c_breakdown = []
-            for s_name, items in subs.items():
-                s_net = sum(i['value'] for i in items)
+            for s_idx, (s_name, s_agg) in enumerate(c_agg["subclasses"].items()):
+                s_net = s_agg["net"]
                 s_pct_class = (s_net / c_net * 100) if c_net else 0
-                
-                grouped = {}
-                name_to_emoji = {}
-                
-                for i in items: 
-                    grouped[i['name']] = grouped.get(i['name'], 0) + i['value']
-                    if i['emoji']: name_to_emoji[i['name']] = i['emoji']
+                name_to_emoji = s_agg["emojis"]
 
                 sorted_h = sorted([
                     {"name": k, "value": v, "emoji": name_to_emoji.get(k, "")} 
-                    for k,v in grouped.items()
+                    for k,v in s_agg["grouped"].items()
                 ], key=lambda x: abs(x['value']), reverse=True)
                 
                 all_holdings = []
                 for h in sorted_h:
                     h_pct = (h['value'] / s_net * 100) if s_net else 0
+                    h_id = matrix_label_id(matrix, "holdings", h['name'])
+                    matrix_values["holdings"][h_id] = matrix_values["holdings"].get(h_id, 0.0) + h['value']
+                    if h['name'] in aggregate["securities"]: matrix["securities"].setdefault(h_id, aggregate["securities"][h['name']])
                     
                     # Search Index: Holdings
                     if abs(h_pct) >= MIN_HOLDING_PERCENTAGE:
                         norm = normalize_search_text(h['name'])
                         if norm:
-                            if norm not in GLOBAL_SEARCH_INDEX["holdings"]:
-                                GLOBAL_SEARCH_INDEX["holdings"][norm] = {
+                            if norm not in search_index["holdings"]:
+                                search_index["holdings"][norm] = {
                                     "displayName": h['name'],
                                     "countryEmoji": h['emoji'],
                                     "occurrences": []
                                 }
                             # Update emoji if missing
-                            if not GLOBAL_SEARCH_INDEX["holdings"][norm]["countryEmoji"] and h['emoji']:
-                                GLOBAL_SEARCH_INDEX["holdings"][norm]["countryEmoji"] = h['emoji']
+                            if not search_index["holdings"][norm]["countryEmoji"] and h['emoji']:
+                                search_index["holdings"][norm]["countryEmoji"] = h['emoji']
                                 
-                            GLOBAL_SEARCH_INDEX["holdings"][norm]["occurrences"].append({
+                            search_index["holdings"][norm]["occurrences"].append({
                                 "trackRef": track_ref,
                                 "assetClass": c_name,
                                 "subclass": s_name,
@@ -547,7 +1421,7 @@ def generate_jsons(target_dir, all_tracks_data, inst_key, config):
                 paginated = [all_holdings[i:i + ITEMS_PER_PAGE] for i in range(0, total_items, ITEMS_PER_PAGE)]
                 
                 # --- FIX: Breakdown Pie uses ABSOLUTE value for Slice Size ---
-                c_breakdown.append({
+                s_entry = {
                     "subclass": s_name, 
                     "value": round(abs(s_net), 9), # <--- Forces visibility
                     "formattedValue": format_currency(s_net),
@@ -555,50 +1429,63 @@ def generate_jsons(target_dir, all_tracks_data, inst_key, config):
                     "itemCount": total_items, 
                     "totalPages": total_pages, 
                     "holdingsPages": paginated
-                })
+                }
+                if output_options.get("lazy_holdings"):
+                    holdings_file = holdings_dir / f"{c_idx}_{s_idx}.json"
+                    submit(write_json, target_dir / holdings_file, columnar_holdings(paginated) if production else paginated,
+                           production=production, totals=output_bytes, before=paginated)
+                    holdings_written.add(holdings_file.name)
+                    del s_entry["holdingsPages"]
+                    s_entry["holdingsFile"] = holdings_file.as_posix()
+                c_breakdown.append(s_entry)
             c_breakdown.sort(key=lambda x: x['value'], reverse=True)
             breakdown[c_name] = c_breakdown
+        if output_options.get("lazy_holdings"): remove_stale_outputs(target_dir / holdings_dir, holdings_written)
             
         asset_classes.sort(key=lambda x: x['value'], reverse=True) # Sort by magnitude
         
-        geo_sunburst_data = calculate_geo_sunburst(data_store)
+        geo_sunburst_data = calculate_geo_sunburst(aggregate)
         # Search Index: Countries
         for item in geo_sunburst_data:
             if item["name"]:
                 norm = normalize_search_text(item["name"])
-                if norm not in GLOBAL_SEARCH_INDEX["countries"]:
-                    GLOBAL_SEARCH_INDEX["countries"][norm] = { "displayName": item["name"], "occurrences": [] }
-                GLOBAL_SEARCH_INDEX["countries"][norm]["occurrences"].append({
+                if norm not in search_index["countries"]:
+                    search_index["countries"][norm] = { "displayName": item["name"], "occurrences": [] }
+                search_index["countries"][norm]["occurrences"].append({
                     "trackRef": track_ref,
                     "value": item["value"]
                 })
 
-        currency_sunburst_data = calculate_currency_sunburst(data_store)
+        currency_sunburst_data = calculate_currency_sunburst(aggregate)
         # Search Index: Currencies
         for item in currency_sunburst_data:
             if item["name"]:
                 norm = normalize_search_text(item["name"])
-                if norm not in GLOBAL_SEARCH_INDEX["currencies"]:
-                    GLOBAL_SEARCH_INDEX["currencies"][norm] = { "displayName": item["name"], "occurrences": [] }
-                GLOBAL_SEARCH_INDEX["currencies"][norm]["occurrences"].append({
+                if norm not in search_index["currencies"]:
+                    search_index["currencies"][norm] = { "displayName": item["name"], "occurrences": [] }
+                search_index["currencies"][norm]["occurrences"].append({
                     "trackRef": track_ref,
                     "value": item["value"]
                 })
 
-        sector_sunburst_data = calculate_sector_sunburst(data_store)
+        sector_sunburst_data = calculate_sector_sunburst(aggregate)
         # Search Index: Sectors
         for item in sector_sunburst_data:
             if item["name"]:
                 norm = normalize_search_text(item["name"])
-                if norm not in GLOBAL_SEARCH_INDEX["sectors"]:
-                    GLOBAL_SEARCH_INDEX["sectors"][norm] = { "displayName": item["name"], "occurrences": [] }
-                GLOBAL_SEARCH_INDEX["sectors"][norm]["occurrences"].append({
+                if norm not in search_index["sectors"]:
+                    search_index["sectors"][norm] = { "displayName": item["name"], "occurrences": [] }
+                search_index["sectors"][norm]["occurrences"].append({
                     "trackRef": track_ref,
                     "value": item["value"]
                 })
 
-        safe_filename = get_safe_filename(t_name)
-        
+        for dim, sunburst_data in [("countries", geo_sunburst_data), ("currencies", currency_sunburst_data), ("sectors", sector_sunburst_data)]:
+            for item in sunburst_data:
+                label_id = matrix_label_id(matrix, dim, item["name"])
+                matrix_values[dim][label_id] = matrix_values[dim].get(label_id, 0.0) + item["value"]
+        exposures[t_id] = track_exposures(aggregate, geo_sunburst_data, currency_sunburst_data, sector_sunburst_data)
+
         final_obj = {
             "fundName": t_name, 
             "trackId": t_id, 
@@ -611,46 +1498,948 @@ def generate_jsons(target_dir, all_tracks_data, inst_key, config):
             "sectorSunburst": sector_sunburst_data
         }
         
-        with open(target_dir / safe_filename, 'w', encoding='utf-8') as f:
-            json.dump(final_obj, f, indent=2, ensure_ascii=False)
+        submit(write_json, target_dir / safe_filename, production_track(final_obj) if production else final_obj,
+               indent=2, production=production, totals=output_bytes, before=final_obj)
             
         manifest_entries.append({"id": t_id, "name": t_name, "file": safe_filename})
-    
-    return sorted(manifest_entries, key=lambda x: x['name']), inst_total_aum
+        add_matrix_row(matrix, t_id, matrix_values, total_assets)
+
+    submit(write_json, target_dir / HOLDINGS_MATRIX_FILE, matrix_json(matrix), production=production, totals=output_bytes)
+    submit(write_json, target_dir / EXPOSURES_FILE, exposures, production=production, totals=output_bytes)
+    return sorted(manifest_entries, key=lambda x: x['name']), inst_total_aum, output_bytes
+
+def process_institution(excel_path, output_dir, master_map, engine="columnar", write_csvs=False, output_options=None, profile_dir=None, streaming=False, period=None, table_dir=None, trace_memory=False):
+    # Parses, classifies and writes one institution's track JSONs. Shares no state with
+    # other institutions, so it can run in a worker process. Returns
+    # (inst_config, manifest_entry, search_index_fragment, output_bytes, report), or None if the workbook can't be read.
+    # With profile_dir, each stage's cProfile stats go to profile_dir/<institution>/<stage>.prof
+    # period ("YYYY-Qn") overrides the report period read from the workbook's cover sheet
+    # table_dir: where to write the institution's holdings table partition
+    # trace_memory: report the institution's and each sheet's peak traced allocations (tracemalloc, several times slower)
+    log(f"--- Processing: {excel_path.name} ---")
+    start = time.perf_counter()
+    if trace_memory: tracemalloc.start()
+    inst_key = excel_path.stem
+    target_dir = output_dir / inst_key
+    target_dir.mkdir(parents=True, exist_ok=True)
+    sheets = read_excel_sheets(excel_path, target_dir if write_csvs else None, STREAMING_CHUNK_ROWS if streaming else None)
+    if sheets is None: return None
+
+    report = {"institution": inst_key, "file": excel_path.name, "cached": False}
+    profilers = {} if profile_dir else None
+    config = {"institutions": {}}
+    search_index = new_search_index()
+    track_aggregates = process_institution_data(sheets, inst_key, config, master_map, engine, report, profilers, streaming, table_dir)
+    with stage(report["stages"], "write", profilers):
+        tracks_list, total_aum, output_bytes = generate_jsons(target_dir, track_aggregates, inst_key, config, search_index, output_options)
+    report["period"] = period or read_report_period(excel_path)
+    if report["period"]:
+        with stage(report["stages"], "history", profilers):
+            periods = update_history(inst_key, report["period"], track_aggregates)
+            write_history_series(inst_key, periods, [t["id"] for t in tracks_list], target_dir,
+                                 production=(output_options or {}).get("production", False), totals=output_bytes)
+    else:
+        log(f"[!] No report period found in {excel_path.name}; history not updated (use --period).")
+    inst_config = config['institutions'][inst_key]
+    inst_name = inst_config.get("name", inst_key)
+    manifest_entry = { "id": inst_key, "name": inst_name, "directory": inst_key, "tracks": tracks_list, "totalAUM": format_currency(total_aum) }
+
+    sheet_reports = report["sheets"]
+    report["rowsRead"] = sum(r["rowsRead"] for r in sheet_reports)
+    report["rowsKept"] = sum(r.get("rowsKept", 0) for r in sheet_reports)
+    report["rowsDropped"] = {}
+    for r in sheet_reports:
+        for reason, n in r.get("rowsDropped", {}).items(): report["rowsDropped"][reason] = report["rowsDropped"].get(reason, 0) + n
+        if "skipped" in r: report["rowsDropped"][r["skipped"]] = report["rowsDropped"].get(r["skipped"], 0) + r["rowsRead"]
+    report["tracks"] = len(tracks_list)
+    report["outputBytes"] = output_bytes
+    report["seconds"] = round(time.perf_counter() - start, 6)
+    if trace_memory:
+        report["peakAllocatedMB"] = max([traced_peak_mb(), *(r["peakAllocatedMB"] for r in sheet_reports if "peakAllocatedMB" in r)])
+        tracemalloc.stop()
+    save_classification_cache()
+    if profilers:
+        (profile_dir / inst_key).mkdir(parents=True, exist_ok=True)
+        for name, profiler in profilers.items(): profiler.dump_stats(profile_dir / inst_key / f"{name}.prof")
+    return inst_config, manifest_entry, search_index, output_bytes, report
+
+def merge_search_index(target, fragment):
+    # Appends an institution's fragment exactly as if its tracks had been indexed into target directly
+    offset = len(target["tracks"])
+    target["tracks"].extend(fragment["tracks"])
+    for section in ["holdings", "countries", "currencies", "sectors"]:
+        for norm, entry in fragment[section].items():
+            occurrences = [{**occ, "trackRef": occ["trackRef"] + offset} for occ in entry["occurrences"]]
+            if norm not in target[section]:
+                target[section][norm] = {**entry, "occurrences": occurrences}
+                continue
+            existing = target[section][norm]
+            if section == "holdings" and not existing["countryEmoji"] and entry["countryEmoji"]:
+                existing["countryEmoji"] = entry["countryEmoji"]
+            existing["occurrences"].extend(occurrences)
+
+# --- Search Index Shards ---
+
+def shard_prefixes(norm):
+    prefixes = set()
+    for word in re.split(SEARCH_WORD_SEPARATORS, norm):
+        if len(word) < SEARCH_SHARD_PREFIX_LENGTH: continue
+        prefixes.add(word[:SEARCH_SHARD_PREFIX_LENGTH])
+        if word[0] in HEBREW_PREFIX_LETTERS and len(word) > SEARCH_SHARD_PREFIX_LENGTH:
+            prefixes.add(word[1:1 + SEARCH_SHARD_PREFIX_LENGTH])
+    return prefixes
+
+def write_search_shards(search_index, shard_dir, production=False, totals=None):
+    # Root file: tracks, lookup tables, prefix -> shard number, and the small sections
+    # (countries, currencies, sectors) with [trackRef, value] occurrences.
+    # Shard files (holdings_<n>.json): [normalized, displayName, countryEmoji, [[trackRef, classId, subclassId, value], ...]]
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    class_ids, subclass_ids = {}, {}
+    shards = {}
+    for norm, entry in search_index["holdings"].items():
+        occurrences = [[
+            occ["trackRef"],
+            class_ids.setdefault(occ["assetClass"], len(class_ids)),
+            subclass_ids.setdefault(occ["subclass"], len(subclass_ids)),
+            occ["value"]
+        ] for occ in entry["occurrences"]]
+        record = [norm, entry["displayName"], entry["countryEmoji"], occurrences]
+        for prefix in shard_prefixes(norm):
+            shards.setdefault(prefix, []).append(record)
+
+    shard_list = {}
+    for n, prefix in enumerate(sorted(shards)):
+        write_json(shard_dir / f"holdings_{n}.json", shards[prefix], production=production, totals=totals)
+        shard_list[prefix] = n
+    remove_stale_outputs(shard_dir, {f"holdings_{n}.json" for n in shard_list.values()}, "holdings_*.json*")
+
+    def compact(section):
+        return {norm: {"displayName": entry["displayName"], "occurrences": [[occ["trackRef"], occ["value"]] for occ in entry["occurrences"]]}
+                for norm, entry in section.items()}
+
+    root = {
+        "prefixLength": SEARCH_SHARD_PREFIX_LENGTH,
+        "tracks": search_index["tracks"],
+        "countries": compact(search_index["countries"]),
+        "currencies": compact(search_index["currencies"]),
+        "sectors": compact(search_index["sectors"]),
+        "assetClasses": list(class_ids),
+        "subclasses": list(subclass_ids),
+        "shards": shard_list
+    }
+    write_json(shard_dir / "index.json", root, production=production, totals=totals)
+    return len(shard_list)
+
+# --- Binary Search Index ---
+
+def write_binary_search_index(search_index, path):
+    # Metadata (tracks, class and subclass names) is JSON at the end; readers only load it to decode occurrences
+    class_ids, subclass_ids = {}, {}
+    blob = bytearray()
+    def blob_ref(text):
+        data = text.encode('utf-8')
+        blob.extend(data)
+        return len(blob) - len(data), len(data)
+
+    entries = sorted(search_index["holdings"].items(), key=lambda item: item[0].encode('utf-8'))
+    key_table, occurrence_table = bytearray(), bytearray()
+    occurrence_count = 0
+    for norm, entry in entries:
+        for occ in entry["occurrences"]:
+            occurrence_table += BINARY_INDEX_OCCURRENCE.pack(
+                occ["trackRef"], class_ids.setdefault(occ["assetClass"], len(class_ids)),
+                subclass_ids.setdefault(occ["subclass"], len(subclass_ids)), occ["value"])
+        key_table += BINARY_INDEX_KEY.pack(*blob_ref(norm), *blob_ref(entry["displayName"]), *blob_ref(entry["countryEmoji"] or ""),
+                                           occurrence_count, len(entry["occurrences"]))
+        occurrence_count += len(entry["occurrences"])
+    meta = json.dumps({"tracks": search_index["tracks"], "assetClasses": list(class_ids), "subclasses": list(subclass_ids)},
+                      ensure_ascii=False, separators=JSON_MINIFIED_SEPARATORS).encode('utf-8')
+
+    keys_at = BINARY_INDEX_HEADER.size
+    occurrences_at = keys_at + len(key_table)
+    blob_at = occurrences_at + len(occurrence_table)
+    meta_at = blob_at + len(blob)
+    header = BINARY_INDEX_HEADER.pack(BINARY_INDEX_MAGIC, len(entries), occurrence_count, keys_at, occurrences_at, blob_at, meta_at, meta_at + len(meta))
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        for part in [header, key_table, occurrence_table, blob, meta]: f.write(part)
+    os.replace(tmp_path, path)  # Readers holding the old file mapped keep a consistent view
+    return meta_at + len(meta)
+
+@contextmanager
+def open_binary_search_index(path):
+    # Yields a handle for lookup_holding / holdings_with_prefix. Only the header is read up front.
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, key_count, occurrence_count, keys_at, occurrences_at, blob_at, meta_at, end = BINARY_INDEX_HEADER.unpack_from(mm, 0)
+        if magic != BINARY_INDEX_MAGIC: raise ValueError(f"{path} is not a binary search index")
+        yield {"mm": mm, "keys": key_count, "keysAt": keys_at, "occurrencesAt": occurrences_at,
+               "blobAt": blob_at, "metaAt": meta_at, "end": end, "meta": None}
+
+def index_key_entry(index, i):
+    return BINARY_INDEX_KEY.unpack_from(index["mm"], index["keysAt"] + i * BINARY_INDEX_KEY.size)
+
+def index_text(index, offset, length):
+    start = index["blobAt"] + offset
+    return index["mm"][start:start + length]
+
+def index_key(index, i):
+    offset, length = BINARY_INDEX_KEY.unpack_from(index["mm"], index["keysAt"] + i * BINARY_INDEX_KEY.size)[:2]
+    return index_text(index, offset, length)
+
+def decode_index_entry(index, i):
+    if index["meta"] is None: index["meta"] = json.loads(index["mm"][index["metaAt"]:index["end"]])
+    meta = index["meta"]
+    key_off, key_len, name_off, name_len, emoji_off, emoji_len, first, count = index_key_entry(index, i)
+    occurrences = []
+    for n in range(first, first + count):
+        track_ref, class_id, subclass_id, value = BINARY_INDEX_OCCURRENCE.unpack_from(
+            index["mm"], index["occurrencesAt"] + n * BINARY_INDEX_OCCURRENCE.size)
+        occurrences.append({"trackRef": track_ref, "assetClass": meta["assetClasses"][class_id],
+                            "subclass": meta["subclasses"][subclass_id], "value": value})
+    return {
+        "key": index_text(index, key_off, key_len).decode('utf-8'),
+        "displayName": index_text(index, name_off, name_len).decode('utf-8'),
+        "countryEmoji": index_text(index, emoji_off, emoji_len).decode('utf-8'),
+        "occurrences": occurrences
+    }
+
+def lookup_holding(index, norm):
+    # Exact lookup by normalized name (normalize_search_text); None if absent
+    target = norm.encode('utf-8')
+    i = bisect.bisect_left(range(index["keys"]), target, key=lambda n: index_key(index, n))
+    if i < index["keys"] and index_key(index, i) == target: return decode_index_entry(index, i)
+    return None
+
+def holdings_with_prefix(index, prefix, limit=None):
+    # Entries whose normalized name starts with prefix, in key order
+    target = prefix.encode('utf-8')
+    i = bisect.bisect_left(range(index["keys"]), target, key=lambda n: index_key(index, n))
+    results = []
+    while i < index["keys"] and (limit is None or len(results) < limit) and index_key(index, i).startswith(target):
+        results.append(decode_index_entry(index, i))
+        i += 1
+    return results
+
+# --- Similar Tracks ---
+# Built from the holdings matrices on disk, so institutions reused from the build cache take part too
+
+def similarity_vectors(matrices):
+    # matrices: [(inst_dir, holdings matrix JSON)] -> dim -> dense (tracks x labels) array of percentages
+    vectors = {}
+    for dim in HOLDINGS_MATRIX_DIMENSIONS:
+        keys, rows, cols, values, row_base = {}, [], [], [], 0
+        for _, matrix in matrices:
+            sparse = matrix[dim]
+            global_ids = np.array([keys.setdefault(matrix_key(dim, label), len(keys)) for label in sparse["labels"]], dtype=np.int64)
+            rows.append(row_base + np.repeat(np.arange(len(matrix["tracks"])), np.diff(sparse["offsets"])))
+            cols.append(global_ids[np.array(sparse["ids"], dtype=np.int64)])
+            values.append(np.array(sparse["percentages"], dtype=np.float64))
+            row_base += len(matrix["tracks"])
+        dense = np.zeros((row_base, len(keys)))
+        if rows: np.add.at(dense, (np.concatenate(rows), np.concatenate(cols)), np.concatenate(values))
+        vectors[dim] = dense
+    return vectors
+
+def load_holdings_matrices(manifest, output_dir):
+    # ([(manifest entry, holdings matrix JSON)], every matrix row's track in order)
+    matrices = []
+    for inst in manifest:
+        with open(output_dir / inst["directory"] / HOLDINGS_MATRIX_FILE, 'r', encoding='utf-8') as f:
+            matrices.append((inst, json.load(f)))
+    tracks = []
+    for inst, matrix in matrices: tracks.extend(manifest_track_refs(inst, matrix["tracks"]))
+    return matrices, tracks
+
+def manifest_track_refs(inst, track_ids):
+    entries = {t["id"]: t for t in inst["tracks"]}
+    return [{"instDir": inst["directory"], "instName": inst["name"], "id": t_id,
+             "name": entries[t_id]["name"], "file": entries[t_id]["file"]} for t_id in track_ids]
+
+def build_similar_tracks(manifest, output_dir, k=SIMILAR_TRACKS_K):
+    matrices, tracks = load_holdings_matrices(manifest, output_dir)
+    vectors = similarity_vectors(matrices)
+    cosines = {}
+    for dim, dense in vectors.items():
+        norms = np.linalg.norm(dense, axis=1, keepdims=True)
+        unit = np.divide(dense, norms, out=np.zeros_like(dense), where=norms > 0)
+        cosines[dim] = unit @ unit.T
+    score = sum(SIMILARITY_WEIGHTS[dim] * cosines[dim] for dim in HOLDINGS_MATRIX_DIMENSIONS)
+    np.fill_diagonal(score, -np.inf)
+
+    # Overlap: the share of assets two tracks hold in common (sum of the smaller long position per holding)
+    longs = np.clip(vectors["holdings"], 0, None)
+    k = min(k, len(tracks) - 1)
+    similar = []
+    for i in range(len(tracks)):
+        if k <= 0:
+            similar.append([])
+            continue
+        top = np.argpartition(-score[i], k - 1)[:k]
+        top = top[np.argsort(-score[i][top], kind="stable")]
+        overlap = np.minimum(longs[i], longs[top]).sum(axis=1)
+        similar.append([[int(j), round(float(score[i, j]), 4), round(float(overlap[n]), 2),
+                         *[round(float(cosines[dim][i, j]), 4) for dim in HOLDINGS_MATRIX_DIMENSIONS]]
+                        for n, j in enumerate(top)])
+    return {
+        "columns": ["ref", "score", "overlap", *HOLDINGS_MATRIX_DIMENSIONS],
+        "weights": SIMILARITY_WEIGHTS,
+        "tracks": tracks,
+        "similar": similar
+    }
+
+# --- Exposure Rankings ---
+# Leaderboards over every track, built from the exposures files on disk like the similar tracks.
+# Percentiles count tracks without the label as 0%.
+
+def build_exposure_rankings(manifest, output_dir, top_n=RANKINGS_TOP_N):
+    # {"tracks", "topN", "percentiles", dim: {label: {"holders", "top": [[ref, pct], ...], "percentiles"}}}
+    tracks, rows = [], []
+    for inst in manifest:
+        with open(output_dir / inst["directory"] / EXPOSURES_FILE, 'r', encoding='utf-8') as f:
+            exposures = json.load(f)
+        tracks.extend(manifest_track_refs(inst, list(exposures)))
+        rows.extend(exposures.values())
+    rankings = {"tracks": tracks, "topN": top_n, "percentiles": RANKING_PERCENTILES}
+    for dim in EXPOSURE_DIMENSIONS:
+        labels = {}
+        for row in rows:
+            for label in row[dim]: labels[label] = labels.get(label, 0) + 1
+        ranked = {}
+        # Most widely held labels first
+        for label in sorted(labels, key=lambda label: labels[label], reverse=True):
+            shares = np.array([row[dim].get(label, 0.0) for row in rows])
+            top = [i for i in np.argsort(-shares, kind="stable")[:top_n].tolist() if shares[i] != 0]
+            ranked[label] = {
+                "holders": labels[label],
+                "top": [[i, float(shares[i])] for i in top],
+                "percentiles": [round(float(p), 2) for p in np.percentile(shares, RANKING_PERCENTILES)]
+            }
+        rankings[dim] = ranked
+    return rankings
 
-def main():
+# --- Entity Resolution ---
+# The holding names of every institution's holdings matrix are grouped into entities in three passes:
+# names sharing a security identifier, names with the same name key (normalized, legal suffixes
+# dropped, words sorted), then name keys whose words differ only in spacing or by a typo. The last
+# pass only compares keys within blocks sharing a word prefix, and only keys with the same series
+# letters and numbers, so "אמות אגח ד" never joins "אמות אגח ה". A whole extra or different word
+# ("... Select Feeder", "חייבים משתנה" / "חייבים קבועה") always keeps names apart, as do differing identifiers.
+
+def entity_name_key(name):
+    words = [w for w in re.split(SEARCH_WORD_SEPARATORS, normalize_search_text(name)) if w and w not in ENTITY_NAME_SUFFIXES]
+    return " ".join(sorted(words))
+
+def entity_name_markers(key):
+    # Words that tell series and maturities apart: anything with a digit, and one or two letter words
+    return frozenset(w for w in key.split(" ") if len(w) <= 2 or any(c.isdigit() for c in w))
+
+def within_one_edit(a, b):
+    # Levenshtein distance <= 1, with an adjacent transposition counting as one edit
+    if abs(len(a) - len(b)) > 1: return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]: i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+    return a[i:] == b[i + 1:] if len(a) < len(b) else a[i + 1:] == b[i:]
+
+def entity_keys_match(a, b):
+    # True when two name keys hold the same words up to spacing ("taropharma" / "taro pharma") or,
+    # in longer keys, one-edit misspellings of long words
+    only_a, only_b = sorted(set(a.split(" ")) - set(b.split(" "))), sorted(set(b.split(" ")) - set(a.split(" ")))
+    if not only_a and not only_b: return True
+    if not only_a or not only_b: return False
+    if len(only_a) == 1 or len(only_b) == 1:
+        joined, parts = (only_a[0], only_b) if len(only_a) == 1 else (only_b[0], only_a)
+        if len(parts) <= 3 and any("".join(p) == joined for p in itertools.permutations(parts)): return True
+    if min(len(a), len(b)) < ENTITY_SPELLING_MIN_KEY or len(only_a) != len(only_b): return False
+    unmatched = list(only_b)
+    for word in only_a:
+        match = next((w for w in unmatched if min(len(word), len(w)) >= ENTITY_SPELLING_MIN_WORD and within_one_edit(word, w)), None)
+        if match is None: return False
+        unmatched.remove(match)
+    return True
+
+def resolve_entities(names, securities):
+    # names: distinct holding names; securities: each name's set of identifiers.
+    # Returns each name's entity number, numbered by first appearance.
+    parent = list(range(len(names)))
+    ids = [set(s) for s in securities]
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j, trusted=False):
+        a, b = sorted([find(i), find(j)])
+        if a == b or (not trusted and ids[a] and ids[b] and not ids[a] & ids[b]): return
+        parent[b] = a
+        ids[a] |= ids[b]
+
+    by_security = {}
+    for i, name_ids in enumerate(securities):
+        for security in sorted(name_ids): union(by_security.setdefault(security, i), i, trusted=True)
+
+    by_key = {}
+    for i, name in enumerate(names): by_key.setdefault(entity_name_key(name), []).append(i)
+    for key, members in by_key.items():
+        if key:
+            for i in members[1:]: union(members[0], i)
+
+    keys = [key for key in by_key if key]
+    markers = [entity_name_markers(key) for key in keys]
+    blocks = {}
+    for k, key in enumerate(keys):
+        for word in set(key.split(" ")):
+            if len(word) >= ENTITY_BLOCK_PREFIX_LENGTH: blocks.setdefault(word[:ENTITY_BLOCK_PREFIX_LENGTH], []).append(k)
+    compared = set()
+    for block in blocks.values():
+        if len(block) > ENTITY_BLOCK_LIMIT: continue
+        for x, k1 in enumerate(block):
+            for k2 in block[x + 1:]:
+                if markers[k1] != markers[k2] or (k1, k2) in compared: continue
+                compared.add((k1, k2))
+                if entity_keys_match(keys[k1], keys[k2]): union(by_key[keys[k1]][0], by_key[keys[k2]][0])
+
+    numbers = {}
+    return [numbers.setdefault(find(i), len(numbers)) for i in range(len(names))]
+
+def build_entity_index(manifest, output_dir):
+    # {"tracks", "entities": [{name, securities, aliases, tracks, percentages}], "lookup": key -> [entity, ...]}.
+    # An entity's tracks/percentages hold every track that has it, largest share first; "lookup" maps
+    # each alias (normalized) and each identifier to its entities, so "who holds X" is one lookup.
+    matrices, tracks = load_holdings_matrices(manifest, output_dir)
+    names, name_ids, securities, occurrences = [], {}, [], []
+    row_base = 0
+    for _, matrix in matrices:
+        holdings = matrix["holdings"]
+        label_names = []
+        for label, security in zip(holdings["labels"], holdings.get("securities", [""] * len(holdings["labels"]))):
+            i = name_ids.get(label)
+            if i is None:
+                i = name_ids[label] = len(names)
+                names.append(label)
+                securities.append(set())
+            if security: securities[i].add(security)
+            label_names.append(i)
+        for row in range(len(matrix["tracks"])):
+            for n in range(holdings["offsets"][row], holdings["offsets"][row + 1]):
+                occurrences.append((label_names[holdings["ids"][n]], row_base + row, holdings["percentages"][n]))
+        row_base += len(matrix["tracks"])
+
+    numbers = resolve_entities(names, securities)
+    entities = [{"aliases": [], "securities": set(), "holdings": {}, "tracks": {}} for _ in range(max(numbers, default=-1) + 1)]
+    for i, name in enumerate(names):
+        entities[numbers[i]]["aliases"].append(name)
+        entities[numbers[i]]["securities"] |= securities[i]
+    for i, track, pct in occurrences:
+        entity = entities[numbers[i]]
+        entity["tracks"][track] = entity["tracks"].get(track, 0.0) + pct
+        entity["holdings"][i] = entity["holdings"].get(i, 0) + 1
+
+    result, lookup = [], {}
+    for e, entity in enumerate(entities):
+        ranked = sorted(entity["tracks"].items(), key=lambda item: item[1], reverse=True)
+        # The canonical name is the alias held by the most tracks (the first one seen on ties)
+        canonical = max(entity["aliases"], key=lambda name: entity["holdings"].get(name_ids[name], 0))
+        result.append({
+            "name": canonical,
+            "securities": sorted(entity["securities"]),
+            "aliases": entity["aliases"],
+            "tracks": [track for track, _ in ranked],
+            "percentages": [round(pct, HOLDINGS_MATRIX_DECIMALS) for _, pct in ranked]
+        })
+        for key in [*(normalize_search_text(name) for name in entity["aliases"]), *result[-1]["securities"]]:
+            entities_for_key = lookup.setdefault(key, [])
+            if key and e not in entities_for_key: entities_for_key.append(e)
+    lookup.pop("", None)
+    return {"tracks": tracks, "entities": result, "lookup": lookup}
+
+def entity_holders(entity_index, query):
+    # Tracks holding the entity named or identified by query: [(entity, [(track, percentage), ...])]
+    refs = entity_index["lookup"].get(normalize_search_text(query)) or entity_index["lookup"].get(security_key(query), [])
+    result = []
+    for e in refs:
+        entity = entity_index["entities"][e]
+        result.append((entity, [(entity_index["tracks"][t], pct) for t, pct in zip(entity["tracks"], entity["percentages"])]))
+    return result
+
+# --- History Store ---
+# history/<institution>/<period>.json:
+#   {"period", "previous", "tracks": {track id: {"summary", "holdings" | "changed" + "removed"}}, "removedTracks"}
+# A track's first period stores all its holdings; later ones store only [class, subclass, name, value]
+# rows that changed and [class, subclass, name] rows that are gone.
+
+def history_snapshot(track_aggregates):
+    snapshot = {}
+    for t_id, aggregate in track_aggregates.items():
+        total_assets = aggregate["total"]
+        if total_assets == 0: continue
+        holdings = {}
+        for c_name, c_agg in aggregate["classes"].items():
+            for s_name, s_agg in c_agg["subclasses"].items():
+                for name, value in s_agg["grouped"].items(): holdings[(c_name, s_name, name)] = round(value, 9)
+        summary = {
+            "aum": round(total_assets, 9),
+            "assetClasses": {c_name: round(c_agg["net"], 9) for c_name, c_agg in aggregate["classes"].items()},
+            "currencies": {item["name"]: item["value"] for item in calculate_currency_sunburst(aggregate)},
+            "countries": {item["name"]: item["value"] for item in calculate_geo_sunburst(aggregate)}
+        }
+        snapshot[t_id] = {"summary": summary, "holdings": holdings}
+    return snapshot
+
+def history_periods(inst_key):
+    inst_dir = HISTORY_DIRECTORY / inst_key
+    if not inst_dir.exists(): return []
+    return sorted(p.stem for p in inst_dir.glob("*.json") if re.fullmatch(PERIOD_PATTERN, p.stem))
+
+def load_history_period(inst_key, period):
+    with open(HISTORY_DIRECTORY / inst_key / f"{period}.json", 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def replay_history(inst_key, periods):
+    # Holdings of every track as of the last of periods: track id -> {(class, subclass, name): value}
+    state = {}
+    for period in periods:
+        entry = load_history_period(inst_key, period)
+        for t_id in entry["removedTracks"]: state.pop(t_id, None)
+        for t_id, track in entry["tracks"].items():
+            if "holdings" in track:
+                state[t_id] = {tuple(row[:3]): row[3] for row in track["holdings"]}
+                continue
+            holdings = state[t_id]
+            for row in track["removed"]: holdings.pop(tuple(row), None)
+            for row in track["changed"]: holdings[tuple(row[:3])] = row[3]
+    return state
+
+def encode_history_period(period, previous, previous_state, snapshot):
+    tracks = {}
+    for t_id, current in snapshot.items():
+        holdings = current["holdings"]
+        if t_id not in previous_state:
+            tracks[t_id] = {"summary": current["summary"], "holdings": [[*key, value] for key, value in holdings.items()]}
+            continue
+        before = previous_state[t_id]
+        tracks[t_id] = {
+            "summary": current["summary"],
+            "changed": [[*key, value] for key, value in holdings.items() if before.get(key) != value],
+            "removed": [list(key) for key in before if key not in holdings]
+        }
+    return {"period": period, "previous": previous, "tracks": tracks,
+            "removedTracks": [t_id for t_id in previous_state if t_id not in snapshot]}
+
+def update_history(inst_key, period, track_aggregates):
+    # Appends (or, for the latest period, replaces) this run's snapshot. Earlier periods are never rewritten.
+    periods = history_periods(inst_key)
+    if periods and period < periods[-1]:
+        log(f"[!] {inst_key}: {period} is older than the latest stored period ({periods[-1]}); history not updated.")
+        return periods
+    earlier = [p for p in periods if p < period]
+    entry = encode_history_period(period, earlier[-1] if earlier else None, replay_history(inst_key, earlier),
+                                  history_snapshot(track_aggregates))
+    (HISTORY_DIRECTORY / inst_key).mkdir(parents=True, exist_ok=True)
+    write_json(HISTORY_DIRECTORY / inst_key / f"{period}.json", entry)
+    return earlier + [period]
+
+def write_history_series(inst_key, periods, track_ids, target_dir, production=False, totals=None):
+    # data/<institution>/history/<track id>.json: AUM and summary weights (percent of AUM) per period
+    summaries = {period: load_history_period(inst_key, period)["tracks"] for period in periods}
+    series_dir = target_dir / "history"
+    series_dir.mkdir(parents=True, exist_ok=True)
+    for t_id in track_ids:
+        points = [summaries[p][t_id]["summary"] if t_id in summaries[p] else None for p in periods]
+        series = {"trackId": t_id, "periods": periods, "aum": [point["aum"] if point else None for point in points]}
+        for dim in HISTORY_SUMMARY_DIMENSIONS:
+            names = list(dict.fromkeys(name for point in points if point for name in point[dim]))
+            series[dim] = {name: [round(point[dim][name] / point["aum"] * 100, 2) if point and name in point[dim] else None
+                                  for point in points] for name in names}
+        write_json(series_dir / get_safe_filename(t_id), series, production=production, totals=totals)
+    remove_stale_outputs(series_dir, {get_safe_filename(t_id) for t_id in track_ids})
+
+# --- Build Cache ---
+# An institution is rebuilt only when its workbook, the shared inputs (mapping file,
+# master track list) or this script change. Otherwise its track JSONs are left in place
+# and the config, manifest entry and search-index fragment come from the cache.
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+def shared_inputs_hash():
+    digest = hashlib.sha256()
+    for path in [MAPPING_FILE, MASTER_TRACK_FILE, Path(__file__)]:
+        digest.update(file_hash(path).encode() if path.exists() else b"missing")
+    return digest.hexdigest()
+
+def load_build_cache(excel_path, output_dir, cache_key=None):
+    # cache_key None accepts whatever run wrote the cache (build-index)
+    cache_file = BUILD_CACHE_DIRECTORY / f"{excel_path.stem}.json"
+    if not cache_file.exists(): return None
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cache_key is not None and cached.get("key") != cache_key: return None
+        inst_config, manifest_entry, search_index, output_bytes = cached["result"]
+        # The cached fragment points at track files, the holdings matrix and exposures; rebuild if any went missing
+        target_dir = output_dir / excel_path.stem
+        if not all((target_dir / t["file"]).exists() for t in manifest_entry["tracks"]): return None
+        if not all((target_dir / name).exists() for name in [HOLDINGS_MATRIX_FILE, EXPOSURES_FILE]): return None
+        return inst_config, manifest_entry, search_index, output_bytes
+    except Exception: return None
+
+def save_build_cache(excel_path, cache_key, result):
+    BUILD_CACHE_DIRECTORY.mkdir(parents=True, exist_ok=True)
+    with open(BUILD_CACHE_DIRECTORY / f"{excel_path.stem}.json", 'w', encoding='utf-8') as f:
+        json.dump({"key": cache_key, "result": result}, f, ensure_ascii=False)
+
+def init_worker(paths):
+    # Spawned workers (macOS/Windows) re-import this module with the default paths, so the parent's
+    # (PATH_SETTINGS, after --base/--input/--output) are passed in. Forked workers inherit the loaded
+    # mappings and classification cache; spawned ones load them again.
+    globals().update(paths)
+    if COUNTRY_MATCHER is None:
+        load_mappings()
+        load_classification_cache()
+
+def write_shared_outputs(config, manifest, search_index, production, timings, profilers=None):
+    # config.json, the manifest, the search indexes and the cross-institution files, built from the
+    # merged institution results. Returns the byte counts of the data/ files.
+    shared_output_bytes = {}
+    with stage(timings, "writeIndexes", profilers):
+        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=2, ensure_ascii=False)
+        write_json(OUTPUT_BASE_DIRECTORY / "manifest.json", manifest, indent=2,
+                   production=production, totals=shared_output_bytes)
+        
+        log("Saving Search Index...")
+        write_json(OUTPUT_BASE_DIRECTORY / "search_index.json", search_index,
+                   production=production, totals=shared_output_bytes)
+        shard_count = write_search_shards(search_index, OUTPUT_BASE_DIRECTORY / "search",
+                                          production=production, totals=shared_output_bytes)
+        write_binary_search_index(search_index, OUTPUT_BASE_DIRECTORY / BINARY_SEARCH_INDEX_FILE)
+    log(f"Saved {shard_count} search index shards.")
+
+    with stage(timings, "similarity", profilers):
+        similar_tracks = build_similar_tracks(manifest, OUTPUT_BASE_DIRECTORY)
+        write_json(OUTPUT_BASE_DIRECTORY / SIMILAR_TRACKS_FILE, similar_tracks,
+                   production=production, totals=shared_output_bytes)
+    log(f"Saved similar tracks for {len(similar_tracks['tracks'])} tracks.")
+
+    with stage(timings, "rankings", profilers):
+        rankings = build_exposure_rankings(manifest, OUTPUT_BASE_DIRECTORY)
+        write_json(OUTPUT_BASE_DIRECTORY / RANKINGS_FILE, rankings,
+                   production=production, totals=shared_output_bytes)
+    log(f"Saved exposure rankings for {sum(len(rankings[dim]) for dim in EXPOSURE_DIMENSIONS):,} labels.")
+
+    with stage(timings, "entities", profilers):
+        entity_index = build_entity_index(manifest, OUTPUT_BASE_DIRECTORY)
+        write_json(OUTPUT_BASE_DIRECTORY / ENTITIES_FILE, entity_index,
+                   production=production, totals=shared_output_bytes)
+    log(f"Resolved {sum(len(e['aliases']) for e in entity_index['entities']):,} holding names into {len(entity_index['entities']):,} entities.")
+    return shared_output_bytes
+
+COMMANDS = ["ingest", "build-index", "stats", "verify"]
+
+def parse_args(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Without a command (the original interface) the arguments are ingest's
+    if not argv or argv[0] not in COMMANDS + ["-h", "--help"]: argv = ["ingest", *argv]
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--base", metavar="DIR",
+                        help="Project directory with institution_reports/, the master files and data/ (default: $PENSION_TRACKER_BASE, else the repository root).")
+    common.add_argument("--input", metavar="DIR", help="Workbook directory (default: BASE/institution_reports).")
+    common.add_argument("--output", metavar="DIR", help="Dashboard data directory (default: BASE/data).")
+    common.add_argument("--startup-time", action="store_true",
+                        help="Log the module import time, the heavy modules the command loaded and the command's run time.")
+    parser = argparse.ArgumentParser(description="Process institution reports into dashboard JSONs.")
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+    ingest = commands.add_parser("ingest", parents=[common], help="Read the workbooks and write every output (the default).")
+    ingest.add_argument("--engine", choices=["columnar", "rows"], default="columnar",
+                        help="Row classification engine. 'rows' is the original per-row loop, kept for output diffs.")
+    ingest.add_argument("--write-csvs", action="store_true",
+                        help="Debug: also write every parsed sheet to data/<institution>/ as CSV.")
+    ingest.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="Process up to N institutions in parallel worker processes (default: 1, serial).")
+    ingest.add_argument("--lazy-holdings", action="store_true",
+                        help="Write holdings pages to per-subclass files loaded on drill-down instead of embedding them in each track JSON.")
+    ingest.add_argument("--production", action="store_true",
+                        help="Minified JSON with columnar holdings, plus .json.gz/.json.br siblings for static hosting.")
+    ingest.add_argument("--streaming", action="store_true",
+                        help=f"Bounded-memory ingest: parse sheets in batches of {STREAMING_CHUNK_ROWS:,} rows and aggregate holdings as they are read.")
+    ingest.add_argument("--force", action="store_true",
+                        help="Rebuild every institution, ignoring the build cache.")
+    ingest.add_argument("--trace-memory", action="store_true",
+                        help="Report each institution's and sheet's peak allocations in build_report.json (tracemalloc; several times slower).")
+    ingest.add_argument("--profile", action="store_true",
+                        help="Save cProfile stats for each institution's read/classify/write stages under profiles/.")
+    ingest.add_argument("--period", metavar="YYYY-Qn",
+                        help="Report period for the history store (default: read from each workbook's cover sheet).")
+    build_index = commands.add_parser("build-index", parents=[common],
+                                      help="Rebuild the manifest, search indexes and cross-institution files from the build cache, without reading workbooks.")
+    build_index.add_argument("--production", action="store_true", help="Same as ingest --production; match the mode of the last ingest.")
+    stats = commands.add_parser("stats", parents=[common], help="Summarize the processed output.")
+    stats.add_argument("--json", action="store_true", help="Print the summary as JSON.")
+    commands.add_parser("verify", parents=[common], help="Check that the output is complete and consistent; exits with status 1 if not.")
+    args = parser.parse_args(argv)
+    if args.command == "ingest" and args.period and not re.fullmatch(PERIOD_PATTERN, args.period):
+        parser.error(f"--period must look like 2025-Q3, got {args.period!r}")
+    return args
+
+def run_ingest(args):
+    start = time.perf_counter()
+    timings = {}
+    profilers = {} if args.profile else None
+    profile_dir = PROFILE_DIRECTORY if args.profile else None
     log("Starting Pipeline...")
-    if not load_mappings(): return
-    log("Loading Master Track List...")
-    master_map = load_master_track_list() or {}
+    with stage(timings, "loadInputs", profilers):
+        if not load_mappings(): return
+        load_classification_cache()
+        log("Loading Master Track List...")
+        master_map = load_master_track_list() or {}
     config = {"institutions": {}} 
     if not INPUT_DIRECTORY.exists(): return
     excel_files = list(INPUT_DIRECTORY.glob("*.xlsx"))
     global_manifest = []
     OUTPUT_BASE_DIRECTORY.mkdir(parents=True, exist_ok=True)
 
+    output_options = {"lazy_holdings": args.lazy_holdings, "production": args.production}
+    if args.production and brotli is None:
+        log("[!] brotli is not installed: writing .json.gz siblings only.")
+    if args.streaming:
+        log("[!] --streaming keeps no line items: the holdings table is not updated.")
+    elif not PYARROW_AVAILABLE:
+        log("pyarrow is not installed: writing the holdings table as .npy columns.")
+    # Output options change the files written, so they are part of the cache key; so is the engine,
+    # or --engine rows after a columnar run would reuse the columnar output it is meant to be diffed against
+    cache_keys, cached = {}, {}
+    with stage(timings, "cacheCheck", profilers):
+        inputs_hash = shared_inputs_hash() + json.dumps({**output_options, "engine": args.engine, "streaming": args.streaming, "period": args.period,
+                                                       "holdingsTable": "parquet" if PYARROW_AVAILABLE else "npy"}, sort_keys=True)
+        for excel_path in excel_files:
+            cache_keys[excel_path] = hashlib.sha256((inputs_hash + file_hash(excel_path)).encode()).hexdigest()
+            # CSV debug output, profiles and memory traces only exist for institutions that actually run
+            if args.force or args.write_csvs or args.profile or args.trace_memory: continue
+            result = load_build_cache(excel_path, OUTPUT_BASE_DIRECTORY, cache_keys[excel_path])
+            if result is not None:
+                log(f"--- Unchanged: {excel_path.name} (reusing cached output) ---")
+                cached[excel_path] = result
+    to_build = [p for p in excel_files if p not in cached]
+
+    worker = partial(process_institution, output_dir=OUTPUT_BASE_DIRECTORY, master_map=master_map,
+                     engine=args.engine, write_csvs=args.write_csvs, output_options=output_options, profile_dir=profile_dir,
+                     streaming=args.streaming, period=args.period, table_dir=HOLDINGS_TABLE_DIRECTORY, trace_memory=args.trace_memory)
+    if args.jobs > 1 and len(to_build) > 1:
+        log(f"Processing {len(to_build)} institutions with {args.jobs} workers...")
+        executor = ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                                       initargs=({name: globals()[name] for name in PATH_SETTINGS},))
+        built = executor.map(worker, to_build)
+    else:
+        executor = None
+        built = map(worker, to_build)
+
+    # Merge in input order so the output matches a serial run byte for byte
+    inst_output_bytes = {}
+    inst_reports = []
+    institutions_start = time.perf_counter()
     for excel_path in excel_files:
-        log(f"--- Processing: {excel_path.name} ---")
-        inst_key = excel_path.stem
-        target_dir = OUTPUT_BASE_DIRECTORY / inst_key
-        target_dir.mkdir(parents=True, exist_ok=True)
-        if split_excel_to_csvs(excel_path, target_dir):
-            all_data = process_institution_data(target_dir, inst_key, config, master_map)
-            tracks_list, total_aum = generate_jsons(target_dir, all_data, inst_key, config)
-            inst_name = config['institutions'][inst_key].get("name", inst_key)
-            formatted_aum = format_currency(total_aum)
-            global_manifest.append({ "id": inst_key, "name": inst_name, "directory": inst_key, "tracks": tracks_list, "totalAUM": formatted_aum })
-
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=2, ensure_ascii=False)
-    with open(OUTPUT_BASE_DIRECTORY / "manifest.json", 'w', encoding='utf-8') as f:
-        json.dump(global_manifest, f, indent=2, ensure_ascii=False)
-    
-    log("Saving Search Index...")
-    with open(OUTPUT_BASE_DIRECTORY / "search_index.json", 'w', encoding='utf-8') as f:
-        json.dump(GLOBAL_SEARCH_INDEX, f, ensure_ascii=False)
+        if excel_path in cached:
+            result = cached[excel_path]
+            inst_reports.append({"institution": excel_path.stem, "file": excel_path.name, "cached": True})
+        else:
+            result = next(built)
+            if result is None:
+                inst_reports.append({"institution": excel_path.stem, "file": excel_path.name, "cached": False, "failed": True})
+                continue
+            *result, inst_report = result
+            inst_reports.append(inst_report)
+            save_build_cache(excel_path, cache_keys[excel_path], result)
+        if result is None: continue
+        inst_config, manifest_entry, search_index, output_bytes = result
+        inst_output_bytes[manifest_entry["name"]] = output_bytes
+        config['institutions'][excel_path.stem] = inst_config
+        global_manifest.append(manifest_entry)
+        merge_search_index(GLOBAL_SEARCH_INDEX, search_index)
+    if executor: executor.shutdown()
+    timings["institutions"] = round(time.perf_counter() - institutions_start, 6)
+
+    shared_output_bytes = write_shared_outputs(config, global_manifest, GLOBAL_SEARCH_INDEX, args.production, timings, profilers)
+
+    log("Output size (bytes):")
+    for name, sizes in [*inst_output_bytes.items(), ("Manifest & search index", shared_output_bytes)]:
+        line = f"  {name}: {sizes.get('before', 0):,} -> {sizes.get('json', 0):,}"
+        compressed = [f"{label} {sizes[key]:,}" for key, label in [("gz", "gzip"), ("br", "brotli")] if key in sizes]
+        if compressed: line += f" ({', '.join(compressed)})"
+        log(line)
+
+    # Machine-readable run summary, for comparing one quarterly run with the next
+    build_report = {
+        "generatedAt": datetime.now().isoformat(timespec="seconds"),
+        "engine": args.engine,
+        "jobs": args.jobs,
+        "seconds": round(time.perf_counter() - start, 6),
+        "stages": timings,
+        "peakMemoryMB": peak_memory_mb(),
+        **({"workerPeakMemoryMB": peak_memory_mb(children=True)} if executor else {}),
+        "sharedOutputBytes": shared_output_bytes,
+        "institutions": inst_reports
+    }
+    with open(BUILD_REPORT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(build_report, f, indent=2, ensure_ascii=False)
+    log(f"Build report: {BUILD_REPORT_FILE}")
+    if profilers:
+        (profile_dir / "pipeline").mkdir(parents=True, exist_ok=True)
+        for name, profiler in profilers.items(): profiler.dump_stats(profile_dir / "pipeline" / f"{name}.prof")
+        log(f"Profiles: {profile_dir}")
 
     log(f"--- Pipeline Complete. ---")
 
+def run_build_index(args):
+    # Shared outputs from the institutions' build caches: reads no workbooks, so pandas and openpyxl stay unloaded
+    start = time.perf_counter()
+    timings = {}
+    excel_paths = list(INPUT_DIRECTORY.glob("*.xlsx")) if INPUT_DIRECTORY.exists() else []
+    # Input order matches ingest; without the workbooks, every cached institution in name order
+    if not excel_paths: excel_paths = [Path(f"{p.stem}.xlsx") for p in sorted(BUILD_CACHE_DIRECTORY.glob("*.json"))]
+    config, manifest, search_index = {"institutions": {}}, [], new_search_index()
+    for excel_path in excel_paths:
+        result = load_build_cache(excel_path, OUTPUT_BASE_DIRECTORY)
+        if result is None:
+            log(f"[!] No usable build cache for {excel_path.stem}: run ingest first.")
+            continue
+        inst_config, manifest_entry, fragment, _ = result
+        config['institutions'][excel_path.stem] = inst_config
+        manifest.append(manifest_entry)
+        merge_search_index(search_index, fragment)
+    if not manifest:
+        log("[!] Nothing to index.")
+        return 1
+    write_shared_outputs(config, manifest, search_index, args.production, timings)
+    log(f"--- Indexed {len(manifest)} institutions in {time.perf_counter() - start:.2f}s. ---")
+    return 0
+
+def output_stats():
+    # Summary of data/ from the manifest, the binary index header and the last build report
+    with open(OUTPUT_BASE_DIRECTORY / "manifest.json", 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    files = [p for p in OUTPUT_BASE_DIRECTORY.rglob("*") if p.is_file() and BUILD_CACHE_DIRECTORY not in p.parents]
+    stats = {
+        "outputDirectory": str(OUTPUT_BASE_DIRECTORY),
+        "institutions": [{"name": inst["name"], "tracks": len(inst["tracks"]), "totalAUM": inst["totalAUM"]} for inst in manifest],
+        "tracks": sum(len(inst["tracks"]) for inst in manifest),
+        "files": len(files),
+        "bytes": sum(p.stat().st_size for p in files),
+        "holdings": None,
+        "lastBuild": None
+    }
+    binary_index = OUTPUT_BASE_DIRECTORY / BINARY_SEARCH_INDEX_FILE
+    if binary_index.exists():
+        with open_binary_search_index(binary_index) as index: stats["holdings"] = index["keys"]
+    if BUILD_REPORT_FILE.exists():
+        with open(BUILD_REPORT_FILE, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        stats["lastBuild"] = {"generatedAt": report["generatedAt"], "seconds": report["seconds"],
+                              "cached": sum(1 for r in report["institutions"] if r.get("cached")),
+                              "failed": sum(1 for r in report["institutions"] if r.get("failed"))}
+    return stats
+
+def run_stats(args):
+    if not (OUTPUT_BASE_DIRECTORY / "manifest.json").exists():
+        log(f"[!] No manifest in {OUTPUT_BASE_DIRECTORY}: run ingest first.")
+        return 1
+    stats = output_stats()
+    if args.json:
+        print(json.dumps(stats, indent=2, ensure_ascii=False))
+        return 0
+    print(f"{stats['outputDirectory']}: {len(stats['institutions'])} institutions, {stats['tracks']} tracks, "
+          f"{stats['files']:,} files ({stats['bytes'] / 1024 / 1024:.1f} MB)")
+    for inst in stats["institutions"]: print(f"  {inst['name']}: {inst['tracks']} tracks, {inst['totalAUM']}")
+    if stats["holdings"] is not None: print(f"Search index: {stats['holdings']:,} holdings")
+    if stats["lastBuild"]:
+        build = stats["lastBuild"]
+        print(f"Last build: {build['generatedAt']} in {build['seconds']:.1f}s ({build['cached']} cached, {build['failed']} failed)")
+    return 0
+
+def verify_outputs(output_dir):
+    # Cross-checks the manifest against the files the dashboard loads; returns a list of problems
+    problems = []
+    def load(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+        except Exception as e:
+            problems.append(f"{path.relative_to(output_dir)}: {e}")
+
+    manifest = load(output_dir / "manifest.json")
+    if manifest is None: return problems
+    track_count = 0
+    for inst in manifest:
+        inst_dir = output_dir / inst["directory"]
+        track_ids = [t["id"] for t in inst["tracks"]]
+        track_count += len(track_ids)
+        for t in inst["tracks"]:
+            track = load(inst_dir / t["file"])
+            if track is not None and str(track.get("trackId")) != t["id"]:
+                problems.append(f"{inst['directory']}/{t['file']}: trackId {track.get('trackId')} != manifest id {t['id']}")
+        matrix = load(inst_dir / HOLDINGS_MATRIX_FILE)
+        if matrix is not None and sorted(matrix["tracks"]) != sorted(track_ids):
+            problems.append(f"{inst['directory']}/{HOLDINGS_MATRIX_FILE}: tracks differ from the manifest")
+        exposures = load(inst_dir / EXPOSURES_FILE)
+        if exposures is not None and sorted(exposures) != sorted(track_ids):
+            problems.append(f"{inst['directory']}/{EXPOSURES_FILE}: tracks differ from the manifest")
+
+    search_index = load(output_dir / "search_index.json")
+    if search_index is not None:
+        if len(search_index["tracks"]) != track_count:
+            problems.append(f"search_index.json: {len(search_index['tracks'])} tracks, manifest has {track_count}")
+        for section in ["holdings", "countries", "currencies", "sectors"]:
+            if any(not 0 <= occ["trackRef"] < len(search_index["tracks"])
+                   for entry in search_index[section].values() for occ in entry["occurrences"]):
+                problems.append(f"search_index.json: {section} has occurrences pointing at no track")
+        binary_index = output_dir / BINARY_SEARCH_INDEX_FILE
+        if not binary_index.exists(): problems.append(f"{BINARY_SEARCH_INDEX_FILE}: missing")
+        else:
+            with open_binary_search_index(binary_index) as index:
+                if index["keys"] != len(search_index["holdings"]):
+                    problems.append(f"{BINARY_SEARCH_INDEX_FILE}: {index['keys']} holdings, search_index.json has {len(search_index['holdings'])}")
+                missing = [norm for norm in search_index["holdings"] if lookup_holding(index, norm) is None]
+                if missing: problems.append(f"{BINARY_SEARCH_INDEX_FILE}: {len(missing)} holdings not found, e.g. {missing[0]!r}")
+
+    shard_root = load(output_dir / "search" / "index.json")
+    if shard_root is not None:
+        missing = [n for n in shard_root["shards"].values() if not (output_dir / "search" / f"holdings_{n}.json").exists()]
+        if missing: problems.append(f"search/: {len(missing)} shard files missing")
+    for name in [SIMILAR_TRACKS_FILE, RANKINGS_FILE, ENTITIES_FILE]:
+        shared = load(output_dir / name)
+        if shared is not None and len(shared["tracks"]) != track_count:
+            problems.append(f"{name}: {len(shared['tracks'])} tracks, manifest has {track_count}")
+    leftovers = list(output_dir.rglob("*.tmp"))
+    if leftovers: problems.append(f"{len(leftovers)} partial writes left behind, e.g. {leftovers[0].relative_to(output_dir)}")
+    return problems
+
+def run_verify(args):
+    problems = verify_outputs(OUTPUT_BASE_DIRECTORY)
+    for problem in problems: log(f"[!] {problem}")
+    log(f"{len(problems)} problems found in {OUTPUT_BASE_DIRECTORY}." if problems else f"{OUTPUT_BASE_DIRECTORY} is consistent.")
+    return 1 if problems else 0
+
+COMMAND_HANDLERS = {"ingest": run_ingest, "build-index": run_build_index, "stats": run_stats, "verify": run_verify}
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.base or args.input or args.output: configure_paths(args.base, args.input, args.output)
+    start = time.perf_counter()
+    status = COMMAND_HANDLERS[args.command](args) or 0
+    if args.startup_time:
+        # Written to stderr so stats --json stays parseable
+        print(f"Startup: module import {MODULE_IMPORT_SECONDS * 1000:.0f}ms, {args.command} {(time.perf_counter() - start) * 1000:.0f}ms, "
+              f"heavy modules loaded: {', '.join(loaded_heavy_modules()) or 'none'}", file=sys.stderr)
+    return status
+
+# Everything above is definitions and constants; heavy modules load on first use
+MODULE_IMPORT_SECONDS = time.perf_counter() - MODULE_IMPORT_START
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,326 @@
+import argparse
+import bisect
+import hashlib
+import json
+import re
+import sys
+from functools import lru_cache, partial
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import process_and_generate as pg
+
+# ==========================================
+# Local data API over the processed output
+# ==========================================
+# Loads data/ (manifest, track JSONs, search index, holdings matrices) into memory once and
+# answers queries over HTTP, so ad hoc lookups don't download whole documents. The only
+# static files are index.html and the output directory under /data/ (without dotfiles such as
+# .build_cache); every other path is a 404, so the rest of the checkout is never exposed.
+#
+#   GET /api/tracks                                        institutions and their tracks
+#   GET /api/search?q=<prefix>[&limit=20]                  word-prefix search over the search index
+#   GET /api/holdings?inst=<dir>&track=<id>&class=<name>&subclass=<name>[&page=0]
+#   GET /api/compare?a=<dir>/<id>&b=<dir>/<id>[&min=0.5]   holdings and asset classes side by side
+#   GET /api/exposure?dimension=countries|currencies|sectors&name=<name>[&n=10]
+#
+# Responses carry an ETag (hash of the body) and honour If-None-Match; built responses
+# are kept in an LRU cache.
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+INDEX_FILE = REPO_ROOT / "index.html"
+SEARCH_SECTIONS = ["holdings", "tracks", "countries", "currencies", "sectors"]
+EXPOSURE_DIMENSIONS = ["countries", "currencies", "sectors"]
+DEFAULT_SEARCH_LIMIT = 20
+DEFAULT_EXPOSURE_N = 10
+MAX_LIMIT = 500
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def read_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def holdings_pages(track_dir, subclass):
+    # Pages for one subclass, whichever layout the pipeline wrote (embedded, --production columnar, --lazy-holdings file)
+    holdings = subclass.get("holdingsPages", subclass.get("holdings"))
+    if holdings is None and "holdingsFile" in subclass: holdings = read_json(track_dir / subclass["holdingsFile"])
+    if holdings is None: return []
+    if isinstance(holdings, list): return holdings
+    pages = []
+    for i, name in enumerate(holdings["name"]):
+        if i % holdings["pageSize"] == 0: pages.append([])
+        value = holdings["value"][i]
+        pages[-1].append({"name": name, "value": value, "formattedValue": pg.format_currency(value),
+                          "percentage": holdings["percentage"][i], "countryEmoji": holdings["countryEmoji"][i]})
+    return pages
+
+
+def load_data(data_dir):
+    manifest = read_json(data_dir / "manifest.json")
+    tracks, matrices = {}, {}
+    for inst in manifest:
+        inst_dir = data_dir / inst["directory"]
+        for meta in inst["tracks"]:
+            track = read_json(inst_dir / meta["file"])
+            for subclasses in track["breakdown"].values():
+                for subclass in subclasses:
+                    subclass["holdingsPages"] = holdings_pages(inst_dir, subclass)
+                    subclass.pop("holdings", None)
+                    subclass.pop("holdingsFile", None)
+            tracks[(inst["directory"], meta["id"])] = {"inst": inst, "meta": meta, "data": track}
+        matrix_file = inst_dir / pg.HOLDINGS_MATRIX_FILE
+        if matrix_file.exists(): matrices[inst["directory"]] = read_json(matrix_file)
+    search_index = read_json(data_dir / "search_index.json")
+    return {"manifest": manifest, "tracks": tracks, "matrices": matrices,
+            "search": search_index, "words": search_words(search_index)}
+
+
+def search_words(search_index):
+    # Sorted (word, section, key) entries; a prefix query is a bisect into this list
+    words = []
+    entries = [(section, norm) for section in ["holdings", "countries", "currencies", "sectors"] for norm in search_index[section]]
+    entries += [("tracks", ref) for ref in range(len(search_index["tracks"]))]
+    for section, key in entries:
+        norm = pg.normalize_search_text(search_index["tracks"][key]["name"]) if section == "tracks" else key
+        for word in re.split(pg.SEARCH_WORD_SEPARATORS, norm):
+            if not word: continue
+            words.append((word, section, key))
+            if word[0] in pg.HEBREW_PREFIX_LETTERS and len(word) > 1: words.append((word[1:], section, key))
+    words.sort(key=lambda w: w[0])
+    return words
+
+
+def int_param(params, name, default, low=0, high=MAX_LIMIT):
+    try: value = int(params.get(name, default))
+    except ValueError: raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' must be an integer")
+    if not low <= value <= high: raise ApiError(HTTPStatus.BAD_REQUEST, f"'{name}' must be between {low} and {high}")
+    return value
+
+
+def required_param(params, name):
+    if not params.get(name): raise ApiError(HTTPStatus.BAD_REQUEST, f"missing '{name}'")
+    return params[name]
+
+
+def find_track(data, inst_dir, track_id):
+    track = data["tracks"].get((inst_dir, track_id))
+    if track is None: raise ApiError(HTTPStatus.NOT_FOUND, f"unknown track {inst_dir}/{track_id}")
+    return track
+
+
+def track_summary(track):
+    return {"instDir": track["inst"]["directory"], "instName": track["inst"]["name"],
+            "trackId": track["meta"]["id"], "trackName": track["meta"]["name"]}
+
+
+# --- Endpoints ---
+
+def api_tracks(data, params):
+    return [{"id": inst["id"], "name": inst["name"], "directory": inst["directory"], "totalAUM": inst["totalAUM"],
+             "tracks": [{"id": t["id"], "name": t["name"]} for t in inst["tracks"]]} for inst in data["manifest"]]
+
+
+def api_search(data, params):
+    query = pg.normalize_search_text(required_param(params, "q"))
+    if not query: raise ApiError(HTTPStatus.BAD_REQUEST, "empty query")
+    limit = int_param(params, "limit", DEFAULT_SEARCH_LIMIT, 1)
+    first_word = re.split(pg.SEARCH_WORD_SEPARATORS, query)[0] or query
+    words, index = data["words"], data["search"]
+    results = {section: [] for section in SEARCH_SECTIONS}
+    seen = set()
+    for pos in range(bisect.bisect_left(words, first_word, key=lambda w: w[0]), len(words)):
+        word, section, key = words[pos]
+        if not word.startswith(first_word): break
+        if (section, key) in seen or len(results[section]) >= limit: continue
+        seen.add((section, key))
+        if section == "tracks":
+            track = index["tracks"][key]
+            if query in pg.normalize_search_text(track["name"]): results[section].append(track)
+            continue
+        if query not in key: continue
+        entry = index[section][key]
+        occurrences = [{**occ, **{k: index["tracks"][occ["trackRef"]][k] for k in ["instDir", "id", "name"]}}
+                       for occ in entry["occurrences"]]
+        results[section].append({"key": key, **{k: v for k, v in entry.items() if k != "occurrences"}, "occurrences": occurrences})
+    return results
+
+
+def api_holdings(data, params):
+    track = find_track(data, required_param(params, "inst"), required_param(params, "track"))
+    asset_class, subclass_name = required_param(params, "class"), required_param(params, "subclass")
+    subclass = next((s for s in track["data"]["breakdown"].get(asset_class, []) if s["subclass"] == subclass_name), None)
+    if subclass is None: raise ApiError(HTTPStatus.NOT_FOUND, f"no subclass {asset_class}/{subclass_name} in this track")
+    pages = subclass["holdingsPages"]
+    page = int_param(params, "page", 0, 0, max(len(pages) - 1, 0))
+    return {**track_summary(track), "assetClass": asset_class, "subclass": subclass_name,
+            "itemCount": subclass.get("itemCount", 0), "page": page, "totalPages": len(pages), "holdings": pages[page] if pages else []}
+
+
+def track_ref(value):
+    inst_dir, sep, track_id = (value or "").rpartition("/")
+    if not sep: raise ApiError(HTTPStatus.BAD_REQUEST, f"track reference must be <institution dir>/<track id>, got '{value}'")
+    return inst_dir, track_id
+
+
+def holdings_vector(data, track):
+    # Normalized holding -> (display name, percent of the track's total assets), as the Compare view builds it
+    vector = {}
+    matrix = data["matrices"].get(track["inst"]["directory"])
+    if matrix and track["meta"]["id"] in matrix["tracks"]:
+        row, holdings = matrix["tracks"].index(track["meta"]["id"]), matrix["holdings"]
+        for i in range(holdings["offsets"][row], holdings["offsets"][row + 1]):
+            name = holdings["labels"][holdings["ids"][i]]
+            vector[pg.matrix_key("holdings", name)] = (name, holdings["percentages"][i])
+        return vector
+    total = track["data"]["totalAssetsBN"]
+    for subclasses in track["data"]["breakdown"].values():
+        for subclass in subclasses:
+            for h in (h for page in subclass["holdingsPages"] for h in page):
+                key = pg.matrix_key("holdings", h["name"])
+                name, pct = vector.get(key, (h["name"], 0.0))
+                vector[key] = (name, pct + h["value"] / total * 100)
+    return vector
+
+
+def api_compare(data, params):
+    track_a = find_track(data, *track_ref(params.get("a")))
+    track_b = find_track(data, *track_ref(params.get("b")))
+    try: min_pct = float(params.get("min", pg.MIN_HOLDING_PERCENTAGE))
+    except ValueError: raise ApiError(HTTPStatus.BAD_REQUEST, "'min' must be a number")
+    vector_a, vector_b = holdings_vector(data, track_a), holdings_vector(data, track_b)
+    rows = []
+    for key in dict.fromkeys([*vector_a, *vector_b]):
+        name, pct_a = vector_a.get(key, (None, 0.0))
+        name_b, pct_b = vector_b.get(key, (None, 0.0))
+        if abs(pct_a) <= min_pct and abs(pct_b) <= min_pct: continue
+        rows.append({"name": name or name_b, "pctA": round(pct_a, 4), "pctB": round(pct_b, 4), "diff": round(pct_a - pct_b, 4)})
+    rows.sort(key=lambda r: abs(r["diff"]), reverse=True)
+    classes_a = {c["name"]: c["percentage"] for c in track_a["data"]["assetClasses"]}
+    classes_b = {c["name"]: c["percentage"] for c in track_b["data"]["assetClasses"]}
+    asset_classes = [{"name": name, "pctA": classes_a.get(name, 0), "pctB": classes_b.get(name, 0)}
+                     for name in sorted({*classes_a, *classes_b})]
+    return {"a": track_summary(track_a), "b": track_summary(track_b), "assetClasses": asset_classes, "holdings": rows}
+
+
+def api_exposure(data, params):
+    dimension = required_param(params, "dimension")
+    if dimension not in EXPOSURE_DIMENSIONS: raise ApiError(HTTPStatus.BAD_REQUEST, f"'dimension' must be one of {', '.join(EXPOSURE_DIMENSIONS)}")
+    wanted = pg.normalize_search_text(required_param(params, "name"))
+    n = int_param(params, "n", DEFAULT_EXPOSURE_N, 1)
+    ranked = []
+    for inst_dir, matrix in data["matrices"].items():
+        sparse = matrix[dimension]
+        label_ids = {i for i, label in enumerate(sparse["labels"]) if pg.normalize_search_text(label) == wanted}
+        if not label_ids: continue
+        for row, track_id in enumerate(matrix["tracks"]):
+            pct = sum(sparse["percentages"][i] for i in range(sparse["offsets"][row], sparse["offsets"][row + 1]) if sparse["ids"][i] in label_ids)
+            if pct: ranked.append({**track_summary(find_track(data, inst_dir, track_id)), "percentage": round(pct, 4)})
+    ranked.sort(key=lambda r: r["percentage"], reverse=True)
+    return {"dimension": dimension, "name": params["name"], "tracks": ranked[:n]}
+
+
+ENDPOINTS = {
+    "/api/tracks": api_tracks,
+    "/api/search": api_search,
+    "/api/holdings": api_holdings,
+    "/api/compare": api_compare,
+    "/api/exposure": api_exposure,
+}
+
+
+# --- Server ---
+
+def build_response(data, path, params):
+    # params: sorted (name, value) pairs, so equal queries share an LRU entry
+    try: status, payload = HTTPStatus.OK, ENDPOINTS[path](data, dict(params))
+    except ApiError as e: status, payload = e.status, {"error": str(e)}
+    body = json.dumps(payload, ensure_ascii=False, separators=pg.JSON_MINIFIED_SEPARATORS).encode('utf-8')
+    return status, body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+class DataApiHandler(SimpleHTTPRequestHandler):
+    def __init__(self, *args, respond=None, data_dir=None, **kwargs):
+        self.respond = respond
+        self.data_dir = data_dir.resolve()
+        super().__init__(*args, **kwargs)
+
+    def static_file(self, url_path):
+        # Allowlist: the dashboard page and files under data/; dot-components (.build_cache, partial writes, ..) are refused
+        path = unquote(url_path)
+        if path in ["/", "/index.html"]: return INDEX_FILE
+        if not path.startswith("/data/"): return None
+        parts = [part for part in path[len("/data/"):].split("/") if part]
+        if any(part.startswith(".") or "\\" in part for part in parts): return None
+        target = self.data_dir.joinpath(*parts).resolve()
+        return target if target == self.data_dir or self.data_dir in target.parents else None
+
+    def translate_path(self, path):
+        # An empty path makes send_head answer 404
+        target = self.static_file(urlsplit(path).path)
+        return str(target) if target else ""
+
+    def list_directory(self, path):
+        self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+        return None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not url.path.startswith("/api/"): return super().do_GET()
+        if url.path not in ENDPOINTS:
+            status, body, etag = HTTPStatus.NOT_FOUND, b'{"error":"unknown endpoint"}', None
+        else:
+            params = tuple(sorted((k, v[0]) for k, v in parse_qs(url.query).items()))
+            status, body, etag = self.respond(url.path, params)
+        if etag and status == HTTPStatus.OK and etag in self.headers.get("If-None-Match", ""):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if etag: self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pg.log(f"{self.address_string()} {format % args}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the processed data and a query API on a local port.")
+    parser.add_argument("--data", type=Path, default=REPO_ROOT / "data", help="Pipeline output directory (default: data/).")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8765, help="Port (default: 8765).")
+    parser.add_argument("--cache-size", type=int, default=512, help="API responses kept in the LRU cache (default: 512).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    pg.log(f"Loading {args.data}...")
+    data = load_data(args.data)
+    pg.log(f"Loaded {len(data['tracks'])} tracks from {len(data['manifest'])} institutions.")
+    respond = lru_cache(maxsize=args.cache_size)(partial(build_response, data))
+    handler = partial(DataApiHandler, respond=respond, data_dir=args.data, directory=str(args.data))
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    pg.log(f"Serving on http://{args.host}:{args.port}/ (API under /api/)")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import struct
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+import benchmark
+import process_and_generate as pg
+
+
+@pytest.fixture(scope="module")
+def search_index(tmp_path_factory):
+    # The merged search index of two synthetic institutions, so track refs of the second are offset
+    pg.load_mappings()
+    tmp = tmp_path_factory.mktemp("workbooks")
+    merged = pg.new_search_index()
+    for seed in [1, 2]:
+        path = tmp / f"Synthetic_{seed}.xlsx"
+        benchmark.write_workbook(path, benchmark.parse_args(["--sheets", "6", "--tracks", "3", "--rows", "30"]), seed)
+        config, fragment = {"institutions": {}}, pg.new_search_index()
+        (tmp / path.stem).mkdir()
+        all_data = pg.process_institution_data(pg.read_excel_sheets(path), path.stem, config, {})
+        pg.generate_jsons(tmp / path.stem, all_data, path.stem, config, fragment)
+        pg.merge_search_index(merged, fragment)
+    return merged
+
+
+def expected_entry(norm, entry):
+    return {"key": norm, "displayName": entry["displayName"], "countryEmoji": entry["countryEmoji"] or "",
+            "occurrences": entry["occurrences"]}
+
+
+def test_every_key_matches_the_json_index(search_index, tmp_path):
+    path = tmp_path / pg.BINARY_SEARCH_INDEX_FILE
+    pg.write_binary_search_index(search_index, path)
+    with pg.open_binary_search_index(path) as index:
+        assert index["keys"] == len(search_index["holdings"]) > 100
+        for norm, entry in search_index["holdings"].items():
+            assert pg.lookup_holding(index, norm) == expected_entry(norm, entry)
+
+
+def test_lookup_and_prefix_edge_cases(tmp_path):
+    # Keys that are prefixes of one another, Hebrew and emoji (multi-byte UTF-8), no country emoji
+    def occurrence(ref, value): return {"trackRef": ref, "assetClass": "Stocks", "subclass": "Direct Holdings", "value": value}
+    search_index = pg.new_search_index()
+    search_index["tracks"] = [{"id": str(n)} for n in range(70000)]
+    search_index["holdings"] = {
+        "bank": {"displayName": "Bank", "countryEmoji": None, "occurrences": [occurrence(0, 1.5)]},
+        "bank leumi": {"displayName": "Bank Leumi", "countryEmoji": "🇮🇱", "occurrences": [occurrence(69999, -0.25), occurrence(1, 1e-9)]},
+        "לאומי": {"displayName": "לאומי", "countryEmoji": "🇮🇱", "occurrences": [occurrence(2, 0.1)]},
+        "לאומי קארד": {"displayName": "לאומי קארד", "countryEmoji": "", "occurrences": []},
+        "apple": {"displayName": "Apple Inc.", "countryEmoji": "🇺🇸", "occurrences": [occurrence(3, 123456.789)]}
+    }
+    path = tmp_path / pg.BINARY_SEARCH_INDEX_FILE
+    pg.write_binary_search_index(search_index, path)
+    with pg.open_binary_search_index(path) as index:
+        for norm, entry in search_index["holdings"].items():
+            assert pg.lookup_holding(index, norm) == expected_entry(norm, entry)
+        for missing in ["", "ban", "bank leumi ", "zzz", "לאו"]:
+            assert pg.lookup_holding(index, missing) is None
+        assert [e["key"] for e in pg.holdings_with_prefix(index, "bank")] == ["bank", "bank leumi"]
+        assert [e["key"] for e in pg.holdings_with_prefix(index, "לאומי")] == ["לאומי", "לאומי קארד"]
+        assert [e["key"] for e in pg.holdings_with_prefix(index, "")] == sorted(search_index["holdings"], key=lambda k: k.encode('utf-8'))
+        assert len(pg.holdings_with_prefix(index, "", limit=2)) == 2
+
+
+def test_header_is_little_endian_and_rejects_other_files(search_index, tmp_path):
+    path = tmp_path / pg.BINARY_SEARCH_INDEX_FILE
+    size = pg.write_binary_search_index(search_index, path)
+    data = path.read_bytes()
+    assert len(data) == size
+    magic, keys, occurrences, *offsets, end = struct.unpack_from("<8sIIQQQQQ", data)
+    assert (magic, keys, end) == (pg.BINARY_INDEX_MAGIC, len(search_index["holdings"]), size)
+    assert occurrences == sum(len(e["occurrences"]) for e in search_index["holdings"].values())
+    other = tmp_path / "other.bin"
+    other.write_bytes(b"NOTANIDX" + data[8:])
+    with pytest.raises(ValueError):
+        with pg.open_binary_search_index(other): pass
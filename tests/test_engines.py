@@ -0,0 +1,41 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+import benchmark
+import process_and_generate as pg
+
+
+@pytest.fixture(scope="module")
+def workbook(tmp_path_factory):
+    # A small synthetic report: every sheet type, a title row above each header, English and Hebrew names
+    pg.load_mappings()
+    path = tmp_path_factory.mktemp("workbooks") / "Synthetic_0.xlsx"
+    benchmark.write_workbook(path, benchmark.parse_args(["--tracks", "3", "--rows", "40", "--preamble-rows", "1"]), seed=7)
+    return path
+
+
+def run_engine(workbook, output_dir, engine):
+    # Classifies from cold, so neither engine reuses the other's cached classifications
+    pg.CLASSIFICATION_CACHE.clear()
+    pg.NEW_CLASSIFICATIONS.clear()
+    pg.COUNTRY_NAME_CACHE.clear()
+    config, search_index = {"institutions": {}}, pg.new_search_index()
+    target_dir = output_dir / workbook.stem
+    target_dir.mkdir(parents=True)
+    all_data = pg.process_institution_data(pg.read_excel_sheets(workbook), workbook.stem, config, {}, engine)
+    pg.generate_jsons(target_dir, all_data, workbook.stem, config, search_index)
+    return config, search_index
+
+
+def test_engines_write_identical_output(workbook, tmp_path):
+    columnar = run_engine(workbook, tmp_path / "columnar", "columnar")
+    rows = run_engine(workbook, tmp_path / "rows", "rows")
+    assert columnar == rows
+    files = sorted(p.relative_to(tmp_path / "columnar") for p in (tmp_path / "columnar").rglob("*") if p.is_file())
+    assert files == sorted(p.relative_to(tmp_path / "rows") for p in (tmp_path / "rows").rglob("*") if p.is_file())
+    assert len(files) > 2
+    for name in files:
+        assert (tmp_path / "columnar" / name).read_bytes() == (tmp_path / "rows" / name).read_bytes(), name
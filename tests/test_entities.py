@@ -0,0 +1,78 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+import process_and_generate as pg
+
+
+def entities(*names, securities=None):
+    # Entity number of each name, with no identifiers unless given
+    return pg.resolve_entities(list(names), securities or [set() for _ in names])
+
+
+# --- security_key ---
+
+def test_tase_number_becomes_il_isin():
+    assert pg.security_key(604611) == "IL0006046119"
+    assert pg.security_key("629014") == "IL0006290147"
+
+
+def test_tase_number_read_as_float():
+    assert pg.security_key(604611.0) == pg.security_key("604611.0") == "IL0006046119"
+
+
+def test_isin_check_digit():
+    assert pg.isin_check_digit("US037833100") == "5"
+    assert pg.isin_check_digit("IL000604611") == "9"
+
+
+def test_isin_and_ticker_are_normalized():
+    assert pg.security_key(" us0378331005 ") == "US0378331005"
+    assert pg.security_key("aapl  us") == "AAPL US"
+
+
+def test_missing_and_internal_ids_are_ignored():
+    for raw_id in [None, "", 0, "0", "nan", float("nan"), -5, 10**9]:
+        assert pg.security_key(raw_id) == ""
+    assert pg.security_key(604611, "פנימי") == ""
+
+
+# --- resolve_entities ---
+
+def test_same_name_key_merges():
+    assert entities("Teva Pharmaceutical Industries Ltd", "TEVA PHARMACEUTICAL INDUSTRIES", "industries teva pharmaceutical") == [0, 0, 0]
+
+
+def test_spelling_and_spacing_variants_merge():
+    assert entities("International Business Machines", "International Busines Machines") == [0, 0]
+    assert entities("Taro Pharma Industries", "TaroPharma Industries") == [0, 0]
+
+
+def test_shared_security_merges_different_names():
+    assert entities("בנק לאומי", "Bank Leumi", securities=[{"IL0006046119"}, {"IL0006046119"}]) == [0, 0]
+
+
+def test_different_securities_never_merge():
+    assert entities("International Business Machines", "International Business Machines Corp",
+                    securities=[{"US4592001014"}, {"US4592001015"}]) == [0, 1]
+
+
+def test_series_markers_keep_bond_series_apart():
+    assert entities("אמות אגח ד", "אמות אגח ה", "אמות אגח 4", "אמות אגח 5") == [0, 1, 2, 3]
+
+
+def test_different_word_keeps_names_apart():
+    assert entities("St Pancras Campus London Camden A חייבים משתנה", "St Pancras Campus London Camden A חייבים קבועה") == [0, 1]
+
+
+def test_extra_word_keeps_names_apart():
+    assert entities("Accolade Partners Blockchain 2 Select Feeder", "Accolade Partners Blockchain 2 Feeder") == [0, 1]
+
+
+def test_ticker_like_keys_need_exact_words():
+    assert entities("GSALTEPW INDEX", "GSALTPOW INDEX") == [0, 1]
+    assert entities("SPXEWTR INDEX", "SPXEWNTR INDEX") == [0, 1]
+
+
+def test_option_legs_keep_buy_and_sell_apart():
+    assert entities("אופציה דולר/שקל 65 P3 08/10/25 Discount Sell", "אופציה דולר/שקל 65 P3 08/10/25 Discount") == [0, 1]
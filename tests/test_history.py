@@ -0,0 +1,66 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+import benchmark
+import process_and_generate as pg
+
+
+@pytest.fixture(scope="module")
+def quarters(tmp_path_factory):
+    # Track aggregates of three synthetic quarters. Names repeat from a small pool, so holdings are
+    # kept, revalued, added and dropped between quarters; the third quarter drops a track.
+    pg.load_mappings()
+    tmp = tmp_path_factory.mktemp("workbooks")
+    result = []
+    for seed, tracks in [(1, 3), (2, 3), (3, 2)]:
+        path = tmp / f"Synthetic_{seed}.xlsx"
+        args = benchmark.parse_args(["--sheets", "6", "--tracks", str(tracks), "--rows", "30", "--distinct-names", "60"])
+        benchmark.write_workbook(path, args, seed)
+        result.append(pg.process_institution_data(pg.read_excel_sheets(path), "Synthetic", {"institutions": {}}, {}))
+    return result
+
+
+@pytest.fixture
+def history_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(pg, "HISTORY_DIRECTORY", tmp_path / "history")
+    return tmp_path / "history"
+
+
+def holdings(track_aggregates):
+    return {t_id: track["holdings"] for t_id, track in pg.history_snapshot(track_aggregates).items()}
+
+
+def test_replay_rebuilds_every_period(quarters, history_dir):
+    periods = ["2025-Q1", "2025-Q2", "2025-Q3"]
+    for period, track_aggregates in zip(periods, quarters):
+        assert pg.update_history("Synthetic", period, track_aggregates) == periods[:periods.index(period) + 1]
+    for n, track_aggregates in enumerate(quarters):
+        assert pg.replay_history("Synthetic", periods[:n + 1]) == holdings(track_aggregates)
+
+
+def test_later_periods_are_stored_as_deltas(quarters, history_dir):
+    pg.update_history("Synthetic", "2025-Q1", quarters[0])
+    pg.update_history("Synthetic", "2025-Q2", quarters[1])
+    pg.update_history("Synthetic", "2025-Q3", quarters[2])
+    second, third = pg.load_history_period("Synthetic", "2025-Q2"), pg.load_history_period("Synthetic", "2025-Q3")
+    assert second["previous"] == "2025-Q1"
+    assert all("holdings" not in track for track in second["tracks"].values())
+    assert any(track["changed"] for track in second["tracks"].values())
+    assert any(track["removed"] for track in second["tracks"].values())
+    assert third["removedTracks"] == sorted(set(quarters[1]) - set(quarters[2]))
+
+
+def test_rerunning_the_latest_period_replaces_it(quarters, history_dir):
+    pg.update_history("Synthetic", "2025-Q1", quarters[0])
+    pg.update_history("Synthetic", "2025-Q2", quarters[2])
+    pg.update_history("Synthetic", "2025-Q2", quarters[1])
+    assert pg.replay_history("Synthetic", ["2025-Q1", "2025-Q2"]) == holdings(quarters[1])
+
+
+def test_older_period_is_not_written(quarters, history_dir):
+    pg.update_history("Synthetic", "2025-Q2", quarters[0])
+    assert pg.update_history("Synthetic", "2025-Q1", quarters[1]) == ["2025-Q2"]
+    assert pg.history_periods("Synthetic") == ["2025-Q2"]